@@ -0,0 +1,140 @@
+# Copyright 2024 The KServe Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy
+
+# (batch, contexts) -> [(output metadata, output array), ...]
+BatchFn = Callable[
+    [numpy.ndarray, List[Any]], Awaitable[List[Tuple[Any, numpy.ndarray]]]
+]
+# (rows, context, future) of one queued request
+_Item = Tuple[numpy.ndarray, Any, asyncio.Future]
+
+
+class DynamicBatcher:
+    """Coalesces concurrent requests into batches along the first dimension.
+
+    Requests queue up until ``max_batch_size`` rows are waiting or the oldest
+    request has waited ``max_latency_ms``. Requests are grouped by the trailing
+    shape and dtype of their rows, and each group's rows are concatenated, sent
+    with one call to ``batch_fn`` and every output whose first dimension matches
+    the batch is split back per request. Batches run concurrently, so the next
+    one is collected while the previous one is still in flight.
+
+    Args:
+        batch_fn: Coroutine function taking ``(batch, contexts)`` and returning
+            ``(metadata, array)`` pairs. ``contexts`` holds the context of every
+            request in the batch, in batch order.
+        max_batch_size: Maximum number of rows per batch. A single request larger
+            than this is sent on its own.
+        max_latency_ms: Maximum time the first request of a batch waits for more.
+    """
+
+    def __init__(
+        self, batch_fn: BatchFn, max_batch_size: int = 32, max_latency_ms: float = 5
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._pending = set()
+
+    async def submit(
+        self, rows: numpy.ndarray, context: Any = None
+    ) -> List[Tuple[Any, numpy.ndarray]]:
+        """Queues ``rows`` and returns this request's slice of every output."""
+        if self._worker is None or self._worker.done():
+            # Created lazily so the queue and task bind to the server's event loop
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._collect())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((rows, context, future))
+        return await future
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            # Only requests with the same trailing shape and dtype can be
+            # concatenated, so each kind of request is batched separately
+            groups: Dict[Hashable, List[_Item]] = {}
+            self._add(groups, await self._queue.get())
+            deadline = loop.time() + self.max_latency
+            while groups:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                self._add(groups, item)
+            for items in groups.values():
+                self._dispatch(items)
+
+    def _add(self, groups: Dict[Hashable, List[_Item]], item: _Item) -> None:
+        rows = item[0]
+        key = (rows.shape[1:], rows.dtype.str)
+        items = groups.setdefault(key, [])
+        if items and _size(items) + len(rows) > self.max_batch_size:
+            # Keep the batch within the limit and start the next one with it
+            self._dispatch(items)
+            items = groups[key] = []
+        items.append(item)
+        if _size(items) >= self.max_batch_size:
+            self._dispatch(groups.pop(key))
+
+    def _dispatch(self, items: List[_Item]) -> None:
+        # Keep a reference so the task is not garbage collected while running
+        task = asyncio.get_running_loop().create_task(self._run(items))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _run(self, items: List[_Item]) -> None:
+        sizes = [len(rows) for rows, _, _ in items]
+        try:
+            if len(items) == 1:
+                batch = items[0][0]
+            else:
+                batch = numpy.concatenate([rows for rows, _, _ in items])
+            outputs = await self.batch_fn(batch, [context for _, context, _ in items])
+        except Exception as e:
+            for _, _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        total = sum(sizes)
+        offsets = numpy.cumsum([0] + sizes)
+        for (_, _, future), start, end in zip(items, offsets[:-1], offsets[1:]):
+            if not future.done():
+                future.set_result(
+                    [
+                        (meta, _slice(output, total, start, end))
+                        for meta, output in outputs
+                    ]
+                )
+
+
+def _size(items: List[_Item]) -> int:
+    return sum(len(rows) for rows, _, _ in items)
+
+
+def _slice(output: numpy.ndarray, total: int, start: int, end: int) -> numpy.ndarray:
+    # Outputs without the batch dimension are shared by every request
+    if len(output.shape) > 0 and output.shape[0] == total:
+        return output[start:end]
+    return output
@@ -13,25 +13,27 @@
 # limitations under the License.
 
 import argparse
-import base64
-import io
-from typing import Dict, Union
+import asyncio
+import uuid
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import numpy
 
-from PIL import Image
-from torchvision import transforms
 from kserve import (
     Model,
     ModelServer,
     model_server,
     InferInput,
+    InferOutput,
     InferRequest,
     InferResponse,
     logging,
 )
 from kserve.model import PredictorProtocol
 
+from batcher import DynamicBatcher
+from preprocessing import WIRE_DATATYPES, get_preprocessor, request_instances
+
 
 def image_transform(model_name, data):
     """converts the input image of Bytes Array into Tensor
@@ -41,63 +43,122 @@ def image_transform(model_name, data):
     Returns:
         numpy.array: Returns the numpy array after the image preprocessing.
     """
-    preprocess = transforms.Compose(
-        [
-            transforms.Resize(256),
-            transforms.CenterCrop(224),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-        ]
-    )
-    if model_name == "mnist" or model_name == "cifar10":
-        preprocess = transforms.Compose(
-            [transforms.ToTensor(), transforms.Normalize((0.1307,), (0.3081,))]
-        )
-    byte_array = base64.b64decode(data)
-    image = Image.open(io.BytesIO(byte_array))
-    tensor = preprocess(image).numpy()
-    return tensor
+    return get_preprocessor(model_name)([data])[0]
 
 
 class ImageTransformer(Model):
-    def __init__(self, name: str):
+    def __init__(
+        self,
+        name: str,
+        preprocess_workers: Optional[int] = None,
+        jpeg_draft: bool = True,
+        binary_tensor: bool = True,
+        wire_format: str = "fp32",
+        max_batch_size: int = 32,
+        max_batch_latency_ms: float = 5,
+    ):
         super().__init__(name, return_response_headers=True)
+        # Send tensors to a v2 predictor as raw bytes (REST binary extension or
+        # gRPC raw contents) instead of a JSON list of floats
+        self.binary_tensor = binary_tensor
+        if wire_format not in WIRE_DATATYPES:
+            raise ValueError(f"Unsupported wire format: {wire_format}")
+        self.wire_format = wire_format
+        # Built once and reused by every request of this model
+        self.preprocessor = get_preprocessor(name, preprocess_workers, jpeg_draft)
+        # Concurrent v2 requests are merged into one predictor call
+        self.batcher = (
+            DynamicBatcher(self._predict_batch, max_batch_size, max_batch_latency_ms)
+            if max_batch_size > 1
+            else None
+        )
         self.ready = True
 
-    def preprocess(
+    async def preprocess(
         self, payload: Union[Dict, InferRequest], headers: Dict[str, str] = None
     ) -> Union[Dict, InferRequest]:
         if isinstance(payload, InferRequest):
-            input_tensors = [
-                image_transform(self.name, instance)
-                for instance in payload.inputs[0].data
-            ]
+            instances = request_instances(payload.inputs[0])
         else:
             headers["request-type"] = "v1"
             # Input follows the Tensorflow V1 HTTP API for binary values
             # https://www.tensorflow.org/tfx/serving/api_rest#encoding_binary_values
-            input_tensors = [
-                image_transform(self.name, instance["image"]["b64"])
-                for instance in payload["instances"]
-            ]
-        input_tensors = numpy.asarray(input_tensors)
-        infer_inputs = [
-            InferInput(
-                name="INPUT__0",
-                datatype="FP32",
-                shape=list(input_tensors.shape),
-                data=input_tensors,
-            )
-        ]
-        infer_request = InferRequest(model_name=self.name, infer_inputs=infer_inputs)
+            instances = [instance["image"]["b64"] for instance in payload["instances"]]
+        # Images are decoded in parallel straight into one batch: normalized
+        # (N, C, H, W) for fp32/fp16, resized (N, H, W, C) for uint8. This runs
+        # off the event loop so concurrent requests reach the batcher together
+        # instead of being serialized behind each other's decode.
+        input_tensors = await asyncio.to_thread(
+            self.preprocessor.encode, instances, self.wire_format
+        )
 
-        # Transform to KServe v1/v2 inference protocol
+        # Transform to KServe v1/v2 inference protocol. v1 has no binary
+        # encoding, so it is the only case that still needs JSON float lists.
         if self.predictor_config.predictor_protocol == PredictorProtocol.REST_V1.value:
-            inputs = [{"data": input_tensor.tolist()} for input_tensor in input_tensors]
-            payload = {"instances": inputs}
-            return payload
+            return {"instances": [{"data": tensor} for tensor in input_tensors.tolist()]}
+        return self._infer_request(input_tensors)
+
+    def _infer_request(self, input_tensors: numpy.ndarray) -> InferRequest:
+        infer_input = InferInput(
+            name="INPUT__0",
+            datatype=WIRE_DATATYPES[self.wire_format],
+            shape=list(input_tensors.shape),
+            parameters=self.preprocessor.wire_parameters(self.wire_format),
+        )
+        infer_input.set_data_from_numpy(input_tensors, binary_data=self.binary_tensor)
+        return InferRequest(
+            model_name=self.name,
+            infer_inputs=[infer_input],
+            parameters={"binary_data_output": True} if self.binary_tensor else None,
+        )
+
+    async def predict(
+        self,
+        payload: Union[Dict, InferRequest],
+        headers: Dict[str, str] = None,
+        response_headers: Dict[str, str] = None,
+    ) -> Union[Dict, InferResponse]:
+        if self.batcher is None or not isinstance(payload, InferRequest):
+            return await super().predict(payload, headers, response_headers)
+        outputs = await self.batcher.submit(
+            payload.inputs[0].as_numpy(), (headers, response_headers)
+        )
+        infer_outputs = []
+        for (name, datatype), data in outputs:
+            infer_output = InferOutput(
+                name=name, shape=list(data.shape), datatype=datatype
+            )
+            infer_output.set_data_from_numpy(data, binary_data=False)
+            infer_outputs.append(infer_output)
+        return InferResponse(
+            response_id=payload.id or str(uuid.uuid4()),
+            model_name=self.name,
+            infer_outputs=infer_outputs,
+        )
+
+    async def _predict_batch(
+        self, batch: numpy.ndarray, contexts: List[Tuple[Dict, Dict]]
+    ) -> List[Tuple[Any, numpy.ndarray]]:
+        if len(contexts) == 1:
+            headers, response_headers = contexts[0]
+            response = await super().predict(
+                self._infer_request(batch), headers, response_headers
+            )
         else:
-            return infer_request
+            # Request and trace ids belong to a single caller, so a merged batch
+            # forwards none and every caller gets its own copy of the response
+            # headers
+            batch_response_headers = {}
+            response = await super().predict(
+                self._infer_request(batch), None, batch_response_headers
+            )
+            for _, response_headers in contexts:
+                if response_headers is not None:
+                    response_headers.update(batch_response_headers)
+        return [
+            ((output.name, output.datatype), output.as_numpy())
+            for output in response.outputs
+        ]
 
     def postprocess(
         self,
@@ -119,10 +180,53 @@ class ImageTransformer(Model):
 
 
 parser = argparse.ArgumentParser(parents=[model_server.parser])
+parser.add_argument(
+    "--preprocess_workers",
+    type=int,
+    default=None,
+    help="Threads used to decode images, defaults to the number of CPUs.",
+)
+parser.add_argument(
+    "--disable_binary_tensor",
+    action="store_true",
+    help="Send tensors to a v2 predictor as JSON instead of binary data.",
+)
+parser.add_argument(
+    "--disable_jpeg_draft",
+    action="store_true",
+    help="Decode JPEGs at full resolution before resizing.",
+)
+parser.add_argument(
+    "--wire_format",
+    choices=sorted(WIRE_DATATYPES),
+    default="fp32",
+    help="Tensor sent to the predictor: normalized fp32/fp16, or resized uint8 "
+    "images that the predictor normalizes.",
+)
+parser.add_argument(
+    "--max_batch_size",
+    type=int,
+    default=32,
+    help="Maximum images per batched predictor call, 1 disables batching.",
+)
+parser.add_argument(
+    "--max_batch_latency_ms",
+    type=float,
+    default=5,
+    help="Maximum time a request waits for others to join its batch.",
+)
 args, _ = parser.parse_known_args()
 
 if __name__ == "__main__":
     if args.configure_logging:
         logging.configure_logging(args.log_config_file)
-    model = ImageTransformer(args.model_name)
+    model = ImageTransformer(
+        args.model_name,
+        preprocess_workers=args.preprocess_workers,
+        jpeg_draft=not args.disable_jpeg_draft,
+        binary_tensor=not args.disable_binary_tensor,
+        wire_format=args.wire_format,
+        max_batch_size=args.max_batch_size,
+        max_batch_latency_ms=args.max_batch_latency_ms,
+    )
     ModelServer().start([model])
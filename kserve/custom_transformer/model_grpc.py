@@ -13,67 +13,98 @@
 # limitations under the License.
 
 import argparse
-from typing import Dict
+import asyncio
+from typing import Dict, Optional
+
 import numpy as np
-import io
-from PIL import Image
-from torchvision import transforms
 from kserve import Model, ModelServer, model_server, InferInput, InferRequest, logging
 
+from preprocessing import (
+    WIRE_DATATYPES,
+    ImagePreprocessor,
+    get_preprocessor,
+    request_instances,
+)
+
 
-def image_transform(data):
+def image_transform(data, model_name: str = "imagenet"):
     """converts the input image of Bytes Array into Tensor
     Args:
         request input instance: The request input instance for image.
+        model_name: The model whose preprocessing is applied, ImageNet by default.
     Returns:
-        List: Returns the data key's value and converts that into a list
-        after converting it into a tensor
+        numpy.array: Returns the numpy array after the image preprocessing.
     """
-    preprocess = transforms.Compose(
-        [
-            transforms.Resize(256),
-            transforms.CenterCrop(224),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-        ]
-    )
-    image = Image.open(io.BytesIO(data))
-    tensor = preprocess(image).numpy()
-    return tensor
+    return get_preprocessor(model_name)([data])[0]
 
 
 class ImageTransformer(Model):
     def __init__(
         self,
         name: str,
+        preprocess_workers: Optional[int] = None,
+        wire_format: str = "fp32",
     ):
         super().__init__(name)
+        if wire_format not in WIRE_DATATYPES:
+            raise ValueError(f"Unsupported wire format: {wire_format}")
+        self.wire_format = wire_format
+        self.preprocessor = ImagePreprocessor(workers=preprocess_workers)
+
+    def load(self) -> bool:
+        # Starts the decode threads in the serving process. A forked process
+        # builds a new pool on its first batch, since _map keys it by pid.
+        self.preprocessor.warmup()
         self.ready = True
+        return self.ready
 
-    def preprocess(
+    async def preprocess(
         self, request: InferRequest, headers: Dict[str, str] = None
     ) -> InferRequest:
-        input_tensors = [
-            image_transform(instance) for instance in request.inputs[0].data
-        ]
-        input_tensors = np.asarray(input_tensors)
-        infer_inputs = [
-            InferInput(
-                name="INPUT__0",
-                datatype="FP32",
-                shape=list(input_tensors.shape),
-                data=input_tensors,
-            )
-        ]
-        infer_request = InferRequest(model_name=self.name, infer_inputs=infer_inputs)
+        # Decoding runs off the event loop so other gRPC calls keep being served
+        input_tensors: np.ndarray = await asyncio.to_thread(
+            self.preprocessor.encode,
+            request_instances(request.inputs[0]),
+            self.wire_format,
+        )
+        infer_input = InferInput(
+            name="INPUT__0",
+            datatype=WIRE_DATATYPES[self.wire_format],
+            shape=list(input_tensors.shape),
+            parameters=self.preprocessor.wire_parameters(self.wire_format),
+        )
+        # Ship the tensor as gRPC raw_input_contents instead of repeated floats
+        infer_input.set_data_from_numpy(input_tensors, binary_data=True)
+        infer_request = InferRequest(model_name=self.name, infer_inputs=[infer_input])
         return infer_request
 
 
 parser = argparse.ArgumentParser(parents=[model_server.parser])
+parser.add_argument(
+    "--preprocess_workers",
+    type=int,
+    default=None,
+    help="Threads used to decode images, defaults to the number of CPUs.",
+)
+parser.add_argument(
+    "--wire_format",
+    choices=sorted(WIRE_DATATYPES),
+    default="fp32",
+    help="Tensor sent to the predictor: normalized fp32/fp16, or resized uint8 "
+    "images that the predictor normalizes.",
+)
 args, _ = parser.parse_known_args()
 
 if __name__ == "__main__":
     if args.configure_logging:
         logging.configure_logging(args.log_config_file)
-    model = ImageTransformer(args.model_name)
-    ModelServer(workers=1).start([model])
+    model = ImageTransformer(
+        args.model_name,
+        preprocess_workers=args.preprocess_workers,
+        wire_format=args.wire_format,
+    )
+    model.load()
+    # --workers only forks the REST server. The gRPC server, the path this
+    # transformer serves, stays in this process, which scales across cores
+    # through the decode thread pool instead.
+    ModelServer(workers=args.workers).start([model])
@@ -0,0 +1,210 @@
+# Copyright 2024 The KServe Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy
+from PIL import Image
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+# Wire format -> v2 datatype of the tensor sent to the predictor
+WIRE_DATATYPES = {"fp32": "FP32", "fp16": "FP16", "uint8": "UINT8"}
+
+
+class ImagePreprocessor:
+    """Decodes, resizes and normalizes a batch of images into one NCHW array.
+
+    Equivalent to torchvision's ``Resize -> CenterCrop -> ToTensor -> Normalize``
+    pipeline, but the pipeline parameters are resolved once, images are
+    decoded in a thread pool (PIL releases the GIL while decoding and resizing),
+    JPEGs are decoded at a reduced scale when they are much larger than the
+    target, and normalization runs once over the whole batch.
+
+    Args:
+        resize: Length of the shorter side after resizing, or None to keep the size.
+        crop: Size of the square center crop, or None to skip cropping.
+        mean: Per channel mean used for normalization.
+        std: Per channel standard deviation used for normalization.
+        workers: Number of decode threads. Defaults to the number of CPUs.
+        jpeg_draft: Let the JPEG decoder downscale while decoding.
+        rgb: Convert every image to RGB, otherwise grayscale images keep one channel.
+    """
+
+    def __init__(
+        self,
+        resize: Optional[int] = 256,
+        crop: Optional[int] = 224,
+        mean: Sequence[float] = IMAGENET_MEAN,
+        std: Sequence[float] = IMAGENET_STD,
+        workers: Optional[int] = None,
+        jpeg_draft: bool = True,
+        rgb: bool = True,
+    ):
+        self.resize = resize
+        self.crop = crop
+        self.rgb = rgb
+        self.jpeg_draft = jpeg_draft
+        self.mean = tuple(mean)
+        self.std = tuple(std)
+        # (x / 255 - mean) / std == x * scale - offset
+        std_array = numpy.asarray(std, dtype=numpy.float32)
+        self.scale = (1.0 / (255.0 * std_array)).reshape(1, -1, 1, 1)
+        self.offset = (numpy.asarray(mean, dtype=numpy.float32) / std_array).reshape(
+            1, -1, 1, 1
+        )
+        self.workers = workers or os.cpu_count() or 1
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+
+    def decode(self, data: Union[bytes, str]) -> numpy.ndarray:
+        """Decodes one image into a resized and cropped uint8 HWC array.
+
+        ``str`` input is treated as base64 (JSON payloads), ``bytes`` as the raw
+        encoded image (gRPC contents and the v2 binary tensor extension).
+        """
+        if isinstance(data, str):
+            data = base64.b64decode(data)
+        image = Image.open(io.BytesIO(data))
+        if self.resize and self.jpeg_draft and image.format == "JPEG":
+            # The decoder picks the largest DCT scale that keeps both sides
+            # >= the requested size, so the shorter side stays >= resize.
+            image.draft("RGB", (self.resize, self.resize))
+        grayscale = not self.rgb and image.mode in ("1", "L")
+        image = image.convert("L" if grayscale else "RGB")
+        if self.resize:
+            width, height = image.size
+            short, long = (width, height) if width <= height else (height, width)
+            if short != self.resize:
+                new_long = int(self.resize * long / short)
+                size = (
+                    (self.resize, new_long)
+                    if width <= height
+                    else (new_long, self.resize)
+                )
+                image = image.resize(size, Image.BILINEAR)
+        if self.crop:
+            width, height = image.size
+            left = int(round((width - self.crop) / 2.0))
+            top = int(round((height - self.crop) / 2.0))
+            image = image.crop((left, top, left + self.crop, top + self.crop))
+        array = numpy.asarray(image, dtype=numpy.uint8)
+        return array if array.ndim == 3 else array[:, :, None]
+
+    def decode_batch(self, instances: Sequence[Union[bytes, str]]) -> numpy.ndarray:
+        """Decodes a batch of images into one uint8 NHWC array."""
+        if self.crop and self.rgb:
+            # Every image ends up the same size, so decode straight into the batch.
+            batch = numpy.empty(
+                (len(instances), self.crop, self.crop, 3),
+                dtype=numpy.uint8,
+            )
+
+            def decode_into(index: int) -> None:
+                batch[index] = self.decode(instances[index])
+
+            self._map(decode_into, range(len(instances)))
+            return batch
+        return numpy.stack(self._map(self.decode, instances))
+
+    def normalize(self, batch: numpy.ndarray) -> numpy.ndarray:
+        """Converts a uint8 NHWC batch into a normalized float32 NCHW batch."""
+        output = numpy.empty(
+            (batch.shape[0], batch.shape[3], batch.shape[1], batch.shape[2]),
+            dtype=numpy.float32,
+        )
+        numpy.multiply(batch.transpose(0, 3, 1, 2), self.scale, out=output)
+        output -= self.offset
+        return output
+
+    def __call__(self, instances: Sequence[Union[bytes, str]]) -> numpy.ndarray:
+        return self.normalize(self.decode_batch(instances))
+
+    def encode(
+        self, instances: Sequence[Union[bytes, str]], wire_format: str = "fp32"
+    ) -> numpy.ndarray:
+        """Preprocesses a batch into the array sent to the predictor.
+
+        ``fp32`` and ``fp16`` are normalized NCHW batches. ``uint8`` is the resized
+        NHWC batch, a quarter of the fp32 size, left for the predictor to normalize
+        with the values from ``wire_parameters``.
+        """
+        if wire_format not in WIRE_DATATYPES:
+            raise ValueError(f"Unsupported wire format: {wire_format}")
+        if wire_format == "uint8":
+            return self.decode_batch(instances)
+        batch = self(instances)
+        return batch.astype(numpy.float16) if wire_format == "fp16" else batch
+
+    def wire_parameters(self, wire_format: str = "fp32") -> Dict[str, str]:
+        """Describes the layout of an ``encode`` output as input parameters."""
+        if wire_format != "uint8":
+            return {"layout": "NCHW"}
+        return {
+            "layout": "NHWC",
+            "mean": ",".join(str(value) for value in self.mean),
+            "std": ",".join(str(value) for value in self.std),
+        }
+
+    def warmup(self) -> None:
+        """Runs a dummy JPEG through the pipeline to start the decode threads."""
+        size = self.resize or self.crop or 32
+        buffer = io.BytesIO()
+        Image.new("RGB", (size, size)).save(buffer, format="JPEG")
+        self([buffer.getvalue()] * self.workers)
+
+    def _map(self, fn, items) -> List:
+        items = list(items)
+        if len(items) <= 1 or self.workers <= 1:
+            return [fn(item) for item in items]
+        if self._executor_pid != os.getpid():
+            # Threads do not survive a fork, so every worker process needs its own pool
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="preprocess"
+            )
+            self._executor_pid = os.getpid()
+        return list(self._executor.map(fn, items))
+
+
+def preprocess_config(model_name: str) -> Dict:
+    """Returns the ImagePreprocessor arguments for a model name."""
+    if model_name == "mnist" or model_name == "cifar10":
+        return dict(
+            resize=None, crop=None, mean=(0.1307,), std=(0.3081,), rgb=False
+        )
+    return dict(
+        resize=256, crop=224, mean=IMAGENET_MEAN, std=IMAGENET_STD, rgb=True
+    )
+
+
+@lru_cache(maxsize=None)
+def get_preprocessor(
+    model_name: str, workers: Optional[int] = None, jpeg_draft: bool = True
+) -> ImagePreprocessor:
+    """Returns the preprocessor for a model, built once per process."""
+    return ImagePreprocessor(
+        workers=workers, jpeg_draft=jpeg_draft, **preprocess_config(model_name)
+    )
+
+
+def request_instances(infer_input) -> Sequence[Union[bytes, str]]:
+    """Returns the encoded images of a BYTES input, sent as JSON or as binary data."""
+    if infer_input.data is not None:
+        return infer_input.data
+    return list(infer_input.as_numpy().reshape(-1))
@@ -1,15 +1,21 @@
+import json
 import os
 from flask_cors import CORS
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
 from werkzeug.utils import secure_filename
 from flask_restx import Api, Resource, fields
 from pymilvus import MilvusClient
 from openai import OpenAI
-from imgSearch.feature_extractor import FeatureExtractor
-from imgSearch.predicator import get_similar_image_paths
+from imgSearch.model_registry import model_registry
+from imgSearch.predicator import format_batch_results, get_similar_image_paths, get_similar_image_paths_batch
+from imgSearch.query_cache import get_query_cache
 from utils.env_utils import load_env_config
-from ragQA.qa_rag import answer_question
+from ragQA.qa_rag import answer_question, stream_answer_question
 from ragQA.update_rag import update_rag_collection
+from ragQA.answer_cache import get_answer_cache
+from utils.collection_cache import collection_cache
+from utils.embedding_utils import get_embedding_client, get_embedding_cache
+from utils.index_config import build_search_params, load_index_config
 from utils.logger_util import setup_logging
 
 logger = setup_logging()
@@ -17,7 +23,12 @@ logger = setup_logging()
 
 app = Flask(__name__)
 
-extractor = FeatureExtractor("resnet34")
+# 图像特征提取模型在启动时加载并预热一次，所有请求共享
+IMAGE_MODEL_NAME = os.environ.get("IMAGE_MODEL_NAME", "resnet34")
+extractor = model_registry.get(
+    IMAGE_MODEL_NAME,
+    warm_up=os.environ.get("MODEL_WARMUP", "true").lower() == "true"
+)
 
 origin = os.environ.get("ALLOW_HOST", "http://127.0.0.1:30500")
 
@@ -58,18 +69,33 @@ ns_file = api.namespace('file', description='文件处理相关接口')
 ns_img = api.namespace('img', description='图像搜索相关接口')
 
 # 定义请求模型
+search_params_field = fields.Raw(
+    required=False,
+    description='覆盖默认值的索引检索参数，如 HNSW 的 {"ef": 128}、IVF 的 {"nprobe": 32}，数值越大召回越高、延迟越大'
+)
+
 chat_model = api.model('ChatRequest', {
-    'question': fields.String(required=True, description='用户问题')
+    'question': fields.String(required=True, description='用户问题'),
+    'search_params': search_params_field
 })
 
 upgrade_model = api.model('UpgradeRequest', {
-    'mode': fields.String(required=False, description='操作模式: create 或 upgrade', default='upgrade'),
-    'doc_path': fields.String(required=False, description='文档路径')
+    'mode': fields.String(required=False, description='操作模式: create、upgrade 或 sync（按内容哈希增量同步）', default='upgrade'),
+    'doc_path': fields.String(required=False, description='文档路径'),
+    'resume_from': fields.Integer(required=False, description='从第几个文本块继续写入（中断后续传）', default=0),
+    'source': fields.String(required=False, description='文档来源名称，sync 模式必填，以它识别同一文档的新版本（上传后的文件名是随机的，无法用来匹配旧版本）')
 })
 
 img_search_model = api.model('ImageSearchRequest', {
     'image_path': fields.String(required=True, description='图像文件路径'),
-    'top_k': fields.Integer(required=False, description='返回结果数量', default=10)
+    'top_k': fields.Integer(required=False, description='返回结果数量', default=10),
+    'search_params': search_params_field
+})
+
+img_batch_search_model = api.model('ImageBatchSearchRequest', {
+    'image_paths': fields.List(fields.String, required=True, description='图像文件路径列表'),
+    'top_k': fields.Integer(required=False, description='每张图片返回结果数量', default=10),
+    'search_params': search_params_field
 })
 
 file_upload_model = ns_file.parser()
@@ -110,6 +136,16 @@ def init_clients(config):
 # 全局客户端实例
 config = get_config()
 openai_client, milvus_client = init_clients(config)
+# customize 嵌入服务在启动时建立共享连接池，请求间复用
+if config["embedding_model"].startswith("customize"):
+    get_embedding_client()
+
+# 启动时把问答和图像集合加载到内存，首个请求不再承担加载耗时
+for _collection_name in (config["collection_name"], os.environ.get("IMAGE_COLLECTION_NAME", "image_embeddings")):
+    try:
+        collection_cache.ensure_loaded(milvus_client, _collection_name)
+    except Exception as e:
+        logger.warning(f"Failed to load collection {_collection_name} at startup: {str(e)}")
 
 # 确保上传文件夹存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -220,6 +256,8 @@ class SearchImageResource(Resource):
             data = request.json or {}
             image_url_path = data.get('image_path')
             top_k = int(data.get('top_k', 10))
+            search_params = parse_search_params(
+                data, "IMAGE", "COSINE", os.environ.get("IMAGE_COLLECTION_NAME", "image_embeddings"))
             
             # 从URL路径提取文件名
             filename = os.path.basename(image_url_path)
@@ -228,8 +266,8 @@ class SearchImageResource(Resource):
             if not os.path.exists(image_path):
                 return jsonify({"error": f"Image not found at path: {image_path}"}), 404
             
-            # 初始化图像搜索所需的组件
-            extractor = FeatureExtractor("resnet34")
+            # 使用启动时加载的共享特征提取器
+            extractor = model_registry.get(IMAGE_MODEL_NAME)
             collection_name = os.environ.get("IMAGE_COLLECTION_NAME", "image_embeddings")
             
 
@@ -239,7 +277,8 @@ class SearchImageResource(Resource):
                 milvus_client=milvus_client,
                 extractor=extractor,
                 collection_name=collection_name,
-                top_k=top_k
+                top_k=top_k,
+                search_params=search_params
             )
             
             # 返回结果
@@ -256,11 +295,82 @@ class SearchImageResource(Resource):
                     "data": []
                 })
                 
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
             app.logger.error(f"Error in image search: {str(e)}")
             return jsonify({"error": str(e)}), 500
 
 
+def parse_search_params(data, prefix, metric_type, collection_name):
+    """校验请求中的 search_params，返回覆盖值；参数不适用于集合上实际构建的索引类型时抛出 ValueError"""
+    search_params = data.get("search_params")
+    if not search_params:
+        return None
+    if not isinstance(search_params, dict):
+        raise ValueError("'search_params' must be an object")
+    index_type = collection_cache.index_type(milvus_client, collection_name)
+    build_search_params(load_index_config(prefix, metric_type, index_type), search_params)
+    return search_params
+
+
+def resolve_batch_image_paths(image_url_paths):
+    """将批量请求中的图片URL映射到上传目录，返回 (存在的 (序号, 本地路径) 列表, 结果占位列表)"""
+    found = []
+    results = []
+    for i, image_url_path in enumerate(image_url_paths):
+        image_path = os.path.join(app.config['UPLOAD_FOLDER'], 'images', os.path.basename(image_url_path))
+        if os.path.exists(image_path):
+            found.append((i, image_path))
+            results.append({"image_path": image_url_path, "status": "success", "data": []})
+        else:
+            results.append({"image_path": image_url_path, "status": "error",
+                            "error": f"Image not found at path: {image_path}", "data": []})
+    return found, results
+
+
+@ns_img.route('/search/batch', methods=['POST'])
+class BatchSearchImageResource(Resource):
+    @ns_img.expect(img_batch_search_model)
+    @api.response(200, '搜索成功，按输入顺序返回每张图片的结果')
+    @api.response(400, '参数错误')
+    @api.response(500, '服务器内部错误')
+    def post(self):
+        try:
+            data = request.json or {}
+            image_url_paths = data.get('image_paths')
+            if not isinstance(image_url_paths, list) or not image_url_paths:
+                return jsonify({"error": "Missing 'image_paths' list in request"}), 400
+            max_batch = int(os.environ.get("IMAGE_SEARCH_MAX_BATCH", "5000"))
+            if len(image_url_paths) > max_batch:
+                return jsonify({"error": f"At most {max_batch} images per request"}), 400
+            top_k = int(data.get('top_k', 10))
+            search_params = parse_search_params(
+                data, "IMAGE", "COSINE", os.environ.get("IMAGE_COLLECTION_NAME", "image_embeddings"))
+
+            found, results = resolve_batch_image_paths(image_url_paths)
+            errors = {}
+            batch_results = []
+            if found:
+                batch_results = get_similar_image_paths_batch(
+                    query_image_paths=[image_path for _, image_path in found],
+                    milvus_client=milvus_client,
+                    extractor=model_registry.get(IMAGE_MODEL_NAME),
+                    collection_name=os.environ.get("IMAGE_COLLECTION_NAME", "image_embeddings"),
+                    top_k=top_k,
+                    search_params=search_params,
+                    errors=errors
+                )
+
+            return jsonify(format_batch_results(results, found, batch_results, errors))
+
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            app.logger.error(f"Error in batch image search: {str(e)}")
+            return jsonify({"error": str(e)}), 500
+
+
 @ns_chat.route('')
 class ChatResource(Resource):
     @api.expect(chat_model)
@@ -275,9 +385,10 @@ class ChatResource(Resource):
                 return jsonify({"error": "Missing 'question' field in request"}), 400
             
             question = data["question"]
+            search_params = parse_search_params(data, "QA", "IP", config["collection_name"])
             
-            # 检查集合是否存在
-            if not milvus_client.has_collection(config["collection_name"]):
+            # 检查集合是否存在（使用缓存的元数据，避免每个请求一次RPC）
+            if not collection_cache.has_collection(milvus_client, config["collection_name"]):
                 return jsonify({"error": f"Collection {config['collection_name']} not found"}), 404
             
             # 调用共享的 answer_question 函数获取回答
@@ -288,15 +399,63 @@ class ChatResource(Resource):
                 collection_name=config["collection_name"],
                 embedding_model=config["embedding_model"],
                 grab_top_n_res=config["grab_top_n_res"],
-                llm_model=config["llm_model"]
+                llm_model=config["llm_model"],
+                search_params=search_params
             )
             
             return jsonify(result)
             
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
             app.logger.error(f"Error processing chat request: {str(e)}")
             return jsonify({"error": str(e)}), 500
 
+def _to_sse(events):
+    """把事件字典转换为 Server-Sent Events 格式"""
+    try:
+        for event in events:
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+    except Exception as e:
+        app.logger.error(f"Error while streaming chat response: {str(e)}")
+        yield f"event: error\ndata: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+
+
+@ns_chat.route('/stream')
+class ChatStreamResource(Resource):
+    @api.expect(chat_model)
+    @api.response(200, '成功（text/event-stream，依次推送 sources、token、done 事件）')
+    @api.response(400, '参数错误')
+    @api.response(404, '集合不存在')
+    def post(self):
+        data = request.json
+        if not data or "question" not in data:
+            return jsonify({"error": "Missing 'question' field in request"}), 400
+        try:
+            search_params = parse_search_params(data, "QA", "IP", config["collection_name"])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if not collection_cache.has_collection(milvus_client, config["collection_name"]):
+            return jsonify({"error": f"Collection {config['collection_name']} not found"}), 404
+
+        events = stream_answer_question(
+            question=data["question"],
+            milvus_client=milvus_client,
+            openai_client=openai_client,
+            collection_name=config["collection_name"],
+            embedding_model=config["embedding_model"],
+            grab_top_n_res=config["grab_top_n_res"],
+            llm_model=config["llm_model"],
+            search_params=search_params
+        )
+        return Response(
+            stream_with_context(_to_sse(events)),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+
 @ns_upgrade.route('')
 class UpgradeResource(Resource):
     @api.expect(upgrade_model)
@@ -313,6 +472,8 @@ class UpgradeResource(Resource):
             doc_path = data.get("doc_path")
             if not doc_path:
                 return jsonify({"error": "Missing 'doc_path' field in request"}), 400
+            if mode == "sync" and not data.get("source"):
+                return jsonify({"error": "Missing 'source' field, required in sync mode"}), 400
             
             filename = os.path.basename(doc_path)
             abs_doc_path = os.path.join(app.config['UPLOAD_FOLDER'], 'docs', filename)
@@ -327,13 +488,19 @@ class UpgradeResource(Resource):
                 openai_client=openai_client,
                 collection_name=config["collection_name"],
                 embedding_dim=config["embedding_dim"],
-                embedding_model=config["embedding_model"]
+                embedding_model=config["embedding_model"],
+                resume_from=int(data.get("resume_from", 0)),
+                source=data.get("source")
             )
             
             # 构造返回结果
             result = {
                 "status": "success",
                 "message": update_result["message"],
+                "inserted": update_result.get("inserted"),
+                "deleted": update_result.get("deleted"),
+                "sync": update_result.get("sync"),
+                "failed": update_result.get("failed"),
                 "flush_time": update_result.get("flush_time")
             }
             
@@ -358,13 +525,21 @@ class HealthResource(Resource):
     @api.response(503, '服务不健康')
     def get(self):
         try:
-            # 检查Milvus连接
+            # 检查Milvus连接（健康检查始终访问Milvus，不使用元数据缓存）
             has_collection = milvus_client.has_collection(config["collection_name"])
+            embedding_cache = get_embedding_cache()
+            answer_cache = get_answer_cache()
+            query_cache = get_query_cache()
             return jsonify({
                 "status": "healthy",
                 "milvus_connected": True,
                 "collection_exists": has_collection,
-                "collection_name": config["collection_name"]
+                "collection_name": config["collection_name"],
+                "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+                "answer_cache": answer_cache.stats() if answer_cache else None,
+                "image_models": model_registry.stats(),
+                "image_query_cache": query_cache.stats() if query_cache else None,
+                "collection_cache": collection_cache.stats()
             })
         except Exception as e:
             return jsonify({
@@ -0,0 +1,257 @@
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from openai import AsyncOpenAI
+from pymilvus import AsyncMilvusClient
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+# 初始化完全复用 Flask 应用，不单独调用 load_env_config，两种入口看到的环境变量一致；
+# 同时复用 Flask 应用中的配置、特征提取器和同步客户端；未改写为异步的接口（上传、更新、Swagger、静态文件）仍由 Flask 处理
+import app as flask_module
+from imgSearch.model_registry import model_registry
+from imgSearch.predicator import format_batch_results, get_similar_image_paths, get_similar_image_paths_batch
+from imgSearch.query_cache import get_query_cache
+from ragQA.qa_rag import async_answer_question, async_stream_answer_question
+from ragQA.answer_cache import get_answer_cache
+from utils.collection_cache import collection_cache
+from utils.embedding_utils import AsyncEmbeddingClient, get_embedding_cache
+from utils.logger_util import setup_logging
+
+logger = setup_logging('asgi')
+
+config = flask_module.config
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # 异步客户端绑定事件循环，在启动时创建、关闭时释放
+    app.state.milvus_client = AsyncMilvusClient(uri=config["milvus_uri"], token=config["token"])
+    app.state.openai_client = AsyncOpenAI(api_key=config["tongyi_api_key"], base_url=config["model_base_url"])
+    app.state.embedding_client = (
+        AsyncEmbeddingClient() if config["embedding_model"].startswith("customize") else None
+    )
+    logger.info("Async clients initialized")
+    try:
+        yield
+    finally:
+        await app.state.milvus_client.close()
+        await app.state.openai_client.close()
+        if app.state.embedding_client is not None:
+            await app.state.embedding_client.aclose()
+        logger.info("Async clients closed")
+
+
+async def _read_json(request):
+    try:
+        return await request.json()
+    except (ValueError, json.JSONDecodeError):
+        return None
+
+
+async def chat(request):
+    try:
+        data = await _read_json(request)
+        if not data or "question" not in data:
+            return JSONResponse({"error": "Missing 'question' field in request"}, status_code=400)
+        # 校验时可能要读取集合的索引类型（同步客户端），放到线程中执行
+        search_params = await asyncio.to_thread(
+            flask_module.parse_search_params, data, "QA", "IP", config["collection_name"])
+
+        state = request.app.state
+        if not await collection_cache.async_has_collection(state.milvus_client, config["collection_name"]):
+            return JSONResponse({"error": f"Collection {config['collection_name']} not found"}, status_code=404)
+
+        result = await async_answer_question(
+            question=data["question"],
+            async_milvus_client=state.milvus_client,
+            async_openai_client=state.openai_client,
+            collection_name=config["collection_name"],
+            embedding_model=config["embedding_model"],
+            grab_top_n_res=config["grab_top_n_res"],
+            llm_model=config["llm_model"],
+            embedding_client=state.embedding_client,
+            search_params=search_params
+        )
+        return JSONResponse(result)
+
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        logger.error(f"Error processing chat request: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def chat_stream(request):
+    data = await _read_json(request)
+    if not data or "question" not in data:
+        return JSONResponse({"error": "Missing 'question' field in request"}, status_code=400)
+    try:
+        # 校验时可能要读取集合的索引类型（同步客户端），放到线程中执行
+        search_params = await asyncio.to_thread(
+            flask_module.parse_search_params, data, "QA", "IP", config["collection_name"])
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    state = request.app.state
+    if not await collection_cache.async_has_collection(state.milvus_client, config["collection_name"]):
+        return JSONResponse({"error": f"Collection {config['collection_name']} not found"}, status_code=404)
+
+    events = async_stream_answer_question(
+        question=data["question"],
+        async_milvus_client=state.milvus_client,
+        async_openai_client=state.openai_client,
+        collection_name=config["collection_name"],
+        embedding_model=config["embedding_model"],
+        grab_top_n_res=config["grab_top_n_res"],
+        llm_model=config["llm_model"],
+        embedding_client=state.embedding_client,
+        search_params=search_params
+    )
+
+    async def to_sse():
+        try:
+            async for event in events:
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+        except Exception as e:
+            logger.error(f"Error while streaming chat response: {str(e)}")
+            yield f"event: error\ndata: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(to_sse(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def search_image(request):
+    try:
+        data = await _read_json(request) or {}
+        image_url_path = data.get('image_path')
+        if not image_url_path:
+            return JSONResponse({"error": "Missing 'image_path' field in request"}, status_code=400)
+        top_k = int(data.get('top_k', 10))
+        search_params = await asyncio.to_thread(
+            flask_module.parse_search_params, data, "IMAGE", "COSINE",
+            os.environ.get("IMAGE_COLLECTION_NAME", "image_embeddings"))
+
+        filename = os.path.basename(image_url_path)
+        image_path = os.path.join(flask_module.app.config['UPLOAD_FOLDER'], 'images', filename)
+        if not os.path.exists(image_path):
+            return JSONResponse({"error": f"Image not found at path: {image_path}"}, status_code=404)
+
+        # 特征提取是CPU密集的模型推理，放到线程池中执行，不阻塞事件循环
+        similar_images = await asyncio.to_thread(
+            get_similar_image_paths,
+            query_image_path=image_path,
+            milvus_client=flask_module.milvus_client,
+            extractor=model_registry.get(flask_module.IMAGE_MODEL_NAME),
+            collection_name=os.environ.get("IMAGE_COLLECTION_NAME", "image_embeddings"),
+            top_k=top_k,
+            search_params=search_params
+        )
+
+        return JSONResponse({
+            "status": "success",
+            "message": f"Found {len(similar_images)} similar images" if similar_images else "No similar images found",
+            "data": similar_images
+        })
+
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        logger.error(f"Error in image search: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def search_image_batch(request):
+    try:
+        data = await _read_json(request) or {}
+        image_url_paths = data.get('image_paths')
+        if not isinstance(image_url_paths, list) or not image_url_paths:
+            return JSONResponse({"error": "Missing 'image_paths' list in request"}, status_code=400)
+        max_batch = int(os.environ.get("IMAGE_SEARCH_MAX_BATCH", "5000"))
+        if len(image_url_paths) > max_batch:
+            return JSONResponse({"error": f"At most {max_batch} images per request"}, status_code=400)
+        top_k = int(data.get('top_k', 10))
+        search_params = await asyncio.to_thread(
+            flask_module.parse_search_params, data, "IMAGE", "COSINE",
+            os.environ.get("IMAGE_COLLECTION_NAME", "image_embeddings"))
+
+        found, results = flask_module.resolve_batch_image_paths(image_url_paths)
+        errors = {}
+        batch_results = []
+        if found:
+            batch_results = await asyncio.to_thread(
+                get_similar_image_paths_batch,
+                query_image_paths=[image_path for _, image_path in found],
+                milvus_client=flask_module.milvus_client,
+                extractor=model_registry.get(flask_module.IMAGE_MODEL_NAME),
+                collection_name=os.environ.get("IMAGE_COLLECTION_NAME", "image_embeddings"),
+                top_k=top_k,
+                search_params=search_params,
+                errors=errors
+            )
+
+        return JSONResponse(format_batch_results(results, found, batch_results, errors))
+
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        logger.error(f"Error in batch image search: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def health(request):
+    try:
+        has_collection = await request.app.state.milvus_client.has_collection(config["collection_name"])
+        embedding_cache = get_embedding_cache()
+        answer_cache = get_answer_cache()
+        query_cache = get_query_cache()
+        return JSONResponse({
+            "status": "healthy",
+            "milvus_connected": True,
+            "collection_exists": has_collection,
+            "collection_name": config["collection_name"],
+            "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+            "answer_cache": answer_cache.stats() if answer_cache else None,
+            "image_models": model_registry.stats(),
+            "image_query_cache": query_cache.stats() if query_cache else None,
+            "collection_cache": collection_cache.stats(),
+            "server_mode": "asgi"
+        })
+    except Exception as e:
+        return JSONResponse({"status": "unhealthy", "error": str(e)}, status_code=503)
+
+
+native_app = Starlette(
+    routes=[
+        Route("/api/chat", chat, methods=["POST"]),
+        Route("/api/chat/stream", chat_stream, methods=["POST"]),
+        Route("/api/img/search", search_image, methods=["POST"]),
+        Route("/api/img/search/batch", search_image_batch, methods=["POST"]),
+        Route("/api/health", health, methods=["GET"]),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=[flask_module.origin],
+                   allow_methods=["GET", "POST", "OPTIONS"], allow_headers=["Content-Type"]),
+    ],
+    lifespan=lifespan,
+)
+NATIVE_PATHS = {route.path for route in native_app.routes}
+
+wsgi_app = WSGIMiddleware(flask_module.app)
+
+
+async def app(scope, receive, send):
+    """ASGI入口：热点接口走原生异步实现，其余请求转交Flask"""
+    if scope["type"] == "lifespan" or scope.get("path") in NATIVE_PATHS:
+        await native_app(scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
+
+
+# 运行方式: uvicorn asgi:app --host 0.0.0.0 --port 30500
@@ -0,0 +1,133 @@
+import argparse
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+from feature_extractor import BACKENDS, FeatureExtractor
+
+# 添加系统路径以便导入utils模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.env_utils import load_env_config
+from utils.logger_util import setup_logging
+
+# 设置日志器
+logger = setup_logging('imgSearch.benchmark_backends')
+
+
+def list_sample_images(image_dir, limit):
+    """按固定顺序选取样本图片，保证不同后端使用同一批输入"""
+    paths = []
+    for suffix in ("*.jpg", "*.jpeg", "*.png", "*.JPEG"):
+        paths += glob.glob(os.path.join(image_dir, "**", suffix), recursive=True)
+    return sorted(paths)[:limit]
+
+
+def cosine_agreement(reference, candidate, top_k=5):
+    """
+    比较候选后端与fp32基准的向量一致性
+
+    Args:
+        reference: 基准向量矩阵 (N, D)，已L2归一化
+        candidate: 候选向量矩阵 (N, D)，已L2归一化
+        top_k: 近邻重合率使用的邻居数量
+
+    Returns:
+        dict: 余弦相似度的均值/最小值，以及样本集内top_k近邻的重合率
+    """
+    cosines = np.sum(reference * candidate, axis=1)
+    k = min(top_k, len(reference) - 1)
+    overlap = 0.0
+    if k > 0:
+        # 去掉自身后比较每个样本的近邻集合
+        ref_neighbors = np.argsort(-(reference @ reference.T), axis=1)[:, 1:k + 1]
+        cand_neighbors = np.argsort(-(candidate @ candidate.T), axis=1)[:, 1:k + 1]
+        overlap = float(np.mean([len(set(r) & set(c)) / k for r, c in zip(ref_neighbors, cand_neighbors)]))
+    return {
+        "mean_cosine": float(np.mean(cosines)),
+        "min_cosine": float(np.min(cosines)),
+        f"top{k}_overlap": overlap,
+    }
+
+
+def benchmark(extractor, batch, iterations):
+    """
+    测量单张图片延迟和批量吞吐
+
+    Returns:
+        dict: 单张推理的p50/p95延迟（毫秒）和批量推理吞吐（图片/秒）
+    """
+    single = batch[:1]
+    extractor.embed_tensors(single)
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        extractor.embed_tensors(single)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    extractor.embed_tensors(batch)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        extractor.embed_tensors(batch)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "throughput_img_s": len(batch) * iterations / elapsed,
+    }
+
+
+def main():
+    load_env_config("../.env")
+
+    parser = argparse.ArgumentParser(description="Compare optimized FeatureExtractor backends against eager fp32")
+    parser.add_argument("--model", default=os.environ.get("IMAGE_MODEL_NAME", "resnet34"))
+    parser.add_argument("--backends", nargs="+", default=[b for b in BACKENDS if b != "eager"], choices=BACKENDS)
+    parser.add_argument("--images", default=os.path.join(os.environ.get("TRAIN_IMAGE_ROOT_PATH", "."), "train"))
+    parser.add_argument("--samples", type=int, default=64, help="number of images for the accuracy check")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    paths = list_sample_images(args.images, args.samples)
+    if not paths:
+        logger.error(f"No images found under {args.images}")
+        sys.exit(1)
+    logger.info(f"Using {len(paths)} sample images from {args.images} (torch threads: {torch.get_num_threads()})")
+
+    reference_extractor = FeatureExtractor(args.model, backend="eager")
+    inputs = torch.stack([reference_extractor.load_image(path) for path in paths])
+    batch = inputs[:args.batch_size]
+    reference = reference_extractor.embed_tensors(inputs)
+    baseline = benchmark(reference_extractor, batch, args.iterations)
+
+    results = {"eager": {**baseline, "mean_cosine": 1.0, "min_cosine": 1.0}}
+    for backend in args.backends:
+        if backend == "eager":
+            continue
+        extractor = FeatureExtractor(args.model, backend=backend)
+        if extractor.backend != backend:
+            logger.error(f"Backend {backend} could not be built, skipping")
+            continue
+        results[backend] = {
+            **benchmark(extractor, batch, args.iterations),
+            **cosine_agreement(reference, extractor.embed_tensors(inputs)),
+        }
+
+    logger.info(f"{'backend':<12}{'p50 ms':>10}{'p95 ms':>10}{'img/s':>10}{'speedup':>10}{'mean cos':>10}{'min cos':>10}")
+    for backend, stats in results.items():
+        speedup = stats["throughput_img_s"] / baseline["throughput_img_s"]
+        logger.info(f"{backend:<12}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+                    f"{stats['throughput_img_s']:>10.1f}{speedup:>9.2f}x"
+                    f"{stats['mean_cosine']:>10.4f}{stats['min_cosine']:>10.4f}")
+        overlap = {key: value for key, value in stats.items() if key.endswith("_overlap")}
+        if overlap:
+            logger.info(f"{'':<12}neighbor agreement: {overlap}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,9 @@
+import copy
+import glob
+import hashlib
+import os
+import random
+import tempfile
 import torch
 from PIL import Image
 import timm
@@ -6,8 +12,17 @@ from timm.data import resolve_data_config
 from timm.data.transforms_factory import create_transform
 
 
+BACKENDS = ("eager", "torchscript", "int8", "onnx")
+
+
 class FeatureExtractor:
-    def __init__(self, modelname):
+    def __init__(self, modelname, num_threads=None, channels_last=None, backend=None):
+        # Intra-op threads used by torch for a single forward pass. This is a
+        # process-wide torch setting, so the last extractor created wins.
+        num_threads = num_threads or int(os.environ.get("FEATURE_EXTRACTOR_THREADS", "0"))
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+
         # Try to load the pre-trained model. If downloading weights fails (no internet
         # or hub access), fall back to an uninitialized model to keep the service running.
         try:
@@ -25,6 +40,14 @@ class FeatureExtractor:
             )
         self.model.eval()
 
+        # Channels-last (NHWC) lets the CPU convolution kernels avoid layout
+        # conversions, which is noticeably faster for CNNs such as ResNet.
+        if channels_last is None:
+            channels_last = os.environ.get("FEATURE_EXTRACTOR_CHANNELS_LAST", "true").lower() == "true"
+        self.channels_last = channels_last
+        if channels_last:
+            self.model = self.model.to(memory_format=torch.channels_last)
+
         # Get the input size required by the model
         self.input_size = self.model.default_cfg["input_size"]
 
@@ -32,25 +55,173 @@ class FeatureExtractor:
         # Get the preprocessing function provided by TIMM for the model
         self.preprocess = create_transform(**config)
 
+        # Optionally replace the eager fp32 model with an optimized CPU backend.
+        # If the optimized backend cannot be built, keep serving with eager.
+        self.modelname = modelname
+        self.backend = "eager"
+        self._onnx_session = None
+        backend = backend or os.environ.get("FEATURE_EXTRACTOR_BACKEND", "eager")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown feature extractor backend: {backend}, expected one of {BACKENDS}")
+        if backend != "eager":
+            try:
+                getattr(self, f"_build_{backend}")()
+                self.backend = backend
+            except Exception as e:
+                print(f"Warning: failed to build {backend} backend for {modelname}: {e}\n"
+                      "Falling back to the eager fp32 model.")
+
+    def _example_input(self, batch_size=1):
+        example = torch.zeros((batch_size, *self.input_size))
+        if self.channels_last:
+            example = example.contiguous(memory_format=torch.channels_last)
+        return example
+
+    def _build_torchscript(self):
+        # Trace the model, fold weights into the graph and apply inference-only
+        # graph rewrites (conv/bn folding, op fusion).
+        with torch.inference_mode():
+            traced = torch.jit.trace(self.model, self._example_input(), check_trace=False)
+        self.model = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+    def _calibration_paths(self):
+        # Static quantization needs representative inputs to choose activation
+        # ranges, so it only runs with real images from the calibration directory.
+        calibration_dir = os.environ.get("FEATURE_EXTRACTOR_CALIBRATION_DIR", "")
+        num_images = int(os.environ.get("FEATURE_EXTRACTOR_CALIBRATION_SIZE", "64"))
+        paths = []
+        if calibration_dir:
+            for suffix in ("*.jpg", "*.jpeg", "*.png", "*.JPEG"):
+                paths += glob.glob(os.path.join(calibration_dir, "**", suffix), recursive=True)
+        if not paths:
+            # Activation ranges from random tensors silently degrade every
+            # vector, so refuse and let the caller fall back to eager.
+            raise RuntimeError("int8 calibration needs images in FEATURE_EXTRACTOR_CALIBRATION_DIR")
+        random.Random(0).shuffle(paths)
+        return paths[:num_images]
+
+    def _calibration_batches(self, paths, batch_size=16):
+        for start in range(0, len(paths), batch_size):
+            yield torch.stack([self.load_image(path) for path in paths[start:start + batch_size]])
+
+    def _build_int8(self):
+        # FX graph mode post-training static quantization: conv and linear
+        # layers run as int8 kernels (fbgemm/x86). Dynamic quantization would
+        # only cover nn.Linear, which a pooled-feature ResNet barely has.
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+        # Quantize a copy (Module.to converts in place) and only swap it in
+        # once every step succeeded, so a failure leaves the eager model and
+        # its channels_last setting exactly as configured.
+        calibration_paths = self._calibration_paths()
+        model = copy.deepcopy(self.model).to(memory_format=torch.contiguous_format)
+        example = torch.zeros((1, *self.input_size))
+        prepared = prepare_fx(model, get_default_qconfig_mapping("x86"), example_inputs=(example,))
+        with torch.inference_mode():
+            for batch in self._calibration_batches(calibration_paths):
+                prepared(batch)
+        self.model = convert_fx(prepared)
+        self.channels_last = False
+
+    def _weights_fingerprint(self):
+        # Identifies the exported graph: the weights (pretrained or the random
+        # fallback), the input size and the library versions that traced it.
+        digest = hashlib.sha256(
+            f"{self.modelname}|{tuple(self.input_size)}|{timm.__version__}|{torch.__version__}".encode())
+        for name, tensor in self.model.state_dict().items():
+            digest.update(name.encode())
+            digest.update(tensor.detach().contiguous().cpu().numpy().tobytes())
+        return digest.hexdigest()[:16]
+
+    def _build_onnx(self):
+        # Export once to ONNX and run it with onnxruntime's CPU provider.
+        import onnxruntime as ort
+
+        # The cached export is reused only while the fingerprint matches, so
+        # a weight, timm or input size change re-exports instead of serving
+        # a stale graph.
+        fingerprint = self._weights_fingerprint()
+        onnx_path = os.environ.get("FEATURE_EXTRACTOR_ONNX_PATH") or os.path.join(
+            tempfile.gettempdir(), f"{self.modelname}-{fingerprint}.onnx")
+        fingerprint_path = f"{onnx_path}.fingerprint"
+        cached = None
+        if os.path.exists(onnx_path) and os.path.exists(fingerprint_path):
+            with open(fingerprint_path) as file:
+                cached = file.read().strip()
+        if cached != fingerprint:
+            # Export a contiguous copy next to the target and rename, so
+            # concurrent workers never load a half-written file and a failed
+            # export leaves the eager model untouched
+            tmp_path = f"{onnx_path}.{os.getpid()}.tmp"
+            torch.onnx.export(
+                copy.deepcopy(self.model).to(memory_format=torch.contiguous_format),
+                torch.zeros((1, *self.input_size)),
+                tmp_path,
+                input_names=["input"],
+                output_names=["features"],
+                dynamic_axes={"input": {0: "batch"}, "features": {0: "batch"}},
+                opset_version=17,
+                dynamo=False,
+            )
+            os.replace(tmp_path, onnx_path)
+            with open(fingerprint_path, "w") as file:
+                file.write(fingerprint)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        # Switch over only once the session is ready
+        self._onnx_session = session
+        self._onnx_path = onnx_path
+        self.channels_last = False
+        self.model = None
+
     def __call__(self, imagepath):
-        # Preprocess the input image
-        input_image = Image.open(imagepath).convert("RGB")  # Convert to RGB if needed
-        input_image = self.preprocess(input_image)
+        return self.extract_batch([imagepath])[0]
+
+    def load_image(self, image):
+        # Accept either a file path or an already opened PIL image
+        if not isinstance(image, Image.Image):
+            image = Image.open(image)
+        return self.preprocess(image.convert("RGB"))  # Convert to RGB if needed
+
+    def extract_batch(self, paths_or_images):
+        # Preprocess every image and stack them into a single (N, C, H, W) batch
+        batch = torch.stack([self.load_image(image) for image in paths_or_images])
+        return self.embed_tensors(batch)
 
-        # Convert the image to a PyTorch tensor and add a batch dimension
-        input_tensor = input_image.unsqueeze(0)
+    def embed_tensors(self, batch):
+        # Run one forward pass over a batch of preprocessed images (N, C, H, W)
+        if self._onnx_session is not None:
+            output = self._onnx_session.run(None, {"input": batch.numpy()})[0]
+            features = output.reshape(output.shape[0], -1)
+        else:
+            if self.channels_last:
+                batch = batch.contiguous(memory_format=torch.channels_last)
+            with torch.inference_mode():
+                output = self.model(batch)
 
-        # Perform inference
-        with torch.no_grad():
-            output = self.model(input_tensor)
+            # Extract the feature vectors, one row per image
+            features = output.reshape(output.shape[0], -1).float().numpy()
 
-        # Extract the feature vector
-        feature_vector = output.squeeze().numpy()
+        # L2-normalize the whole matrix at once using numpy to avoid scikit-learn dependency
+        norms = np.linalg.norm(features, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return features / norms
 
-        # L2-normalize using numpy to avoid scikit-learn dependency
-        vec = feature_vector.reshape(-1)
-        norm = np.linalg.norm(vec)
-        if norm > 0:
-            vec = vec / norm
+    def warm_up(self, iterations=1):
+        # Run dummy forward passes so the first real request does not pay for
+        # lazy allocations and kernel selection.
+        dummy = torch.zeros((1, *self.input_size))
+        for _ in range(iterations):
+            self.embed_tensors(dummy)
 
-        return vec
+    def memory_bytes(self):
+        # Size of the model parameters and buffers held in memory. Frozen
+        # TorchScript and quantized modules keep weights as packed constants,
+        # so for optimized backends this is only an approximation.
+        if self._onnx_session is not None:
+            return os.path.getsize(self._onnx_path)
+        tensors = list(self.model.parameters()) + list(self.model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
@@ -0,0 +1,95 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from imgSearch.feature_extractor import FeatureExtractor
+from utils.logger_util import setup_logging
+
+# 设置日志器
+logger = setup_logging('imgSearch.model_registry')
+
+
+class ModelRegistry:
+    """
+    特征提取模型注册表：每个模型在进程内只加载一次，并在请求间共享
+    
+    模型处于eval模式且推理不修改任何状态，可以被多个请求线程并发调用；
+    注册表只需保证加载过程只发生一次。
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._loading_locks = {}
+
+    def get(self, model_name, warm_up=False):
+        """
+        获取（必要时加载）指定名称的特征提取器
+        
+        Args:
+            model_name: timm模型名称
+            warm_up: 首次加载后是否执行预热推理
+        
+        Returns:
+            FeatureExtractor: 共享的特征提取器实例
+        """
+        extractor = self._models.get(model_name)
+        if extractor is not None:
+            return extractor
+
+        with self._lock:
+            loading_lock = self._loading_locks.setdefault(model_name, threading.Lock())
+
+        # 每个模型单独加锁，加载一个模型时不阻塞其他已加载模型的获取
+        with loading_lock:
+            extractor = self._models.get(model_name)
+            if extractor is not None:
+                return extractor
+
+            logger.info(f"Loading feature extractor: {model_name}")
+            start = time.time()
+            extractor = FeatureExtractor(model_name)
+            load_time = round(time.time() - start, 4)
+            self._stats[model_name] = {
+                "load_time_s": load_time,
+                "warmup_time_s": None,
+                "param_memory_mb": round(extractor.memory_bytes() / 1024 / 1024, 2),
+                "loaded_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            logger.info(f"Loaded feature extractor {model_name} in {load_time} seconds")
+            if warm_up:
+                self._warm_up(model_name, extractor)
+            self._models[model_name] = extractor
+            return extractor
+
+    def _warm_up(self, model_name, extractor):
+        start = time.time()
+        extractor.warm_up()
+        warmup_time = round(time.time() - start, 4)
+        self._stats[model_name]["warmup_time_s"] = warmup_time
+        logger.info(f"Warmed up feature extractor {model_name} in {warmup_time} seconds")
+
+    def stats(self):
+        """返回各模型的加载耗时、预热耗时和参数内存，以及进程峰值内存"""
+        return {
+            "models": {name: dict(stats) for name, stats in self._stats.items()},
+            "process_max_rss_mb": _max_rss_mb(),
+        }
+
+
+def _max_rss_mb():
+    """进程峰值内存（MB），resource 模块只在类Unix系统上可用，Windows下返回None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 下 ru_maxrss 单位为字节，Linux 下为KB
+    return round(max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 2)
+
+
+# 进程内共享的模型注册表
+model_registry = ModelRegistry()
@@ -1,70 +1,184 @@
 
+import hashlib
+import io
 import os
 import sys
-from pymilvus import MilvusClient
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+from pymilvus import DataType, MilvusClient
 from feature_extractor import FeatureExtractor
 
 # 添加系统路径以便导入utils模块
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.env_utils import load_env_config
+from utils.index_config import add_vector_index, load_index_config
 from utils.logger_util import setup_logging
 
 # 设置日志器
 logger = setup_logging('imgSearch.model_training')
 
-# 加载环境变量配置
-load_env_config("../.env")
-
-# 从环境变量读取配置
-milvus_uri = os.environ.get("MILVUS_URI", "http://localhost:19530")
-token = os.environ.get("MILVUS_TOKEN", "")
-collection_name = os.environ.get("IMAGE_COLLECTION_NAME", "image_embeddings")
-
-extractor = FeatureExtractor("resnet34")
-
-# 初始化Milvus客户端
-milvus_client = MilvusClient(uri=milvus_uri, token=token)
-logger.info(f"Connected to Milvus: {milvus_uri} successfully")
-
-# Create a collection in quick setup mode
-if milvus_client.has_collection(collection_name=collection_name):
-    milvus_client.drop_collection(collection_name=collection_name)
-    logger.info(f"Dropped existing collection: {collection_name}")
-
-milvus_client.create_collection(
-    collection_name=collection_name,
-    vector_field_name="vector",
-    dimension=512,
-    auto_id=True,
-    enable_dynamic_field=True,
-    metric_type="COSINE",
-)
-logger.info(f"Created collection: {collection_name} with dimension 512")
-
-
-root = os.environ.get("TRAIN_IMAGE_ROOT_PATH", "E:/Github_Self/tutorial/milvus/python/uploads/preset/images")
-
-
-logger.info(f"Starting image feature extraction and insertion from: {root}/train")
-inserted_count = 0
-for _, __, filenames in os.walk(root + "/train"):
-    for filename in filenames:
-        if filename.endswith(".JPEG"):
-            abs_file_path = os.path.join(_, filename)
-            logger.info(f"Processing file: {abs_file_path}")
-            rel_file_path = os.path.relpath(abs_file_path, root)
-
-            try:
-                # 提取特征并插入
-                milvus_client.insert(
-                    collection_name,
-                    {"vector": extractor(abs_file_path), "filepath": rel_file_path},
-                )
-                inserted_count += 1
-                if inserted_count % 100 == 0:
-                    logger.info(f"Inserted {inserted_count} images so far")
-            except Exception as e:
-                logger.error(f"Error processing file {abs_file_path}: {str(e)}")
-
-logger.info(f"Image training completed. Total images inserted: {inserted_count}")
 
+class ImageFileDataset(Dataset):
+    """
+    按路径读取图片并执行模型预处理，由DataLoader的多个工作进程并行解码
+
+    Args:
+        samples: (绝对路径, 相对路径) 列表
+        preprocess: 模型对应的预处理函数
+    """
+
+    def __init__(self, samples, preprocess):
+        self.samples = samples
+        self.preprocess = preprocess
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, index):
+        abs_file_path, rel_file_path = self.samples[index]
+        try:
+            with open(abs_file_path, "rb") as file:
+                content = file.read()
+            # 同时记录内容哈希，查询时相同内容的图片可直接复用已存储的向量
+            content_hash = hashlib.sha256(content).hexdigest()
+            image = Image.open(io.BytesIO(content)).convert("RGB")
+            return self.preprocess(image), rel_file_path, content_hash
+        except Exception as e:
+            # 单张图片损坏时跳过，不中断整个批次
+            logger.error(f"Error processing file {abs_file_path}: {str(e)}")
+            return None
+
+
+def _collate(items):
+    """过滤解码失败的图片后把张量堆叠为一个批次"""
+    items = [item for item in items if item is not None]
+    if not items:
+        return None
+    tensors, rel_paths, content_hashes = zip(*items)
+    return torch.stack(tensors), list(rel_paths), list(content_hashes)
+
+
+def list_images(root, suffix=".JPEG"):
+    """遍历 root/train 下的图片，返回 (绝对路径, 相对root的路径) 列表"""
+    samples = []
+    for dirpath, _, filenames in os.walk(os.path.join(root, "train")):
+        for filename in sorted(filenames):
+            if filename.endswith(suffix):
+                abs_file_path = os.path.join(dirpath, filename)
+                samples.append((abs_file_path, os.path.relpath(abs_file_path, root)))
+    return samples
+
+
+def create_image_collection(milvus_client, collection_name, dimension=512):
+    """创建图像集合，向量索引类型和参数由 IMAGE_INDEX_TYPE / IMAGE_INDEX_PARAMS 配置"""
+    schema = milvus_client.create_schema(auto_id=True, enable_dynamic_field=True)
+    schema.add_field(field_name="id", datatype=DataType.INT64, is_primary=True)
+    schema.add_field(field_name="vector", datatype=DataType.FLOAT_VECTOR, dim=dimension)
+    # 图片内容的sha256，查询时按内容哈希复用已入库的向量
+    schema.add_field(field_name="content_hash", datatype=DataType.VARCHAR, max_length=64)
+
+    index_config = load_index_config("IMAGE", "COSINE")
+    index_params = add_vector_index(milvus_client.prepare_index_params(), "vector", index_config)
+    logger.info(f"Creating {index_config['index_type']} index with params {index_config['index_params']}")
+    # content_hash in [...] 过滤走标量倒排索引，不扫描整个集合
+    index_params.add_index(field_name="content_hash", index_type="INVERTED")
+
+    milvus_client.create_collection(
+        collection_name=collection_name,
+        schema=schema,
+        index_params=index_params,
+    )
+
+
+def index_images(milvus_client, extractor, collection_name, root, batch_size=64, num_workers=4,
+                 insert_batch_size=512):
+    """
+    批量提取图片特征并写入Milvus
+
+    Args:
+        milvus_client: Milvus客户端实例
+        extractor: 特征提取器实例
+        collection_name: 集合名称
+        root: 图片根目录
+        batch_size: 每次前向推理的图片数量
+        num_workers: 图片解码/预处理的工作进程数，0表示在主进程中执行
+        insert_batch_size: 每次写入Milvus的行数
+
+    Returns:
+        int: 写入的图片数量
+    """
+    samples = list_images(root)
+    logger.info(f"Found {len(samples)} images under {root}/train "
+                f"(batch_size={batch_size}, num_workers={num_workers}, insert_batch_size={insert_batch_size})")
+
+    loader = DataLoader(
+        ImageFileDataset(samples, extractor.preprocess),
+        batch_size=batch_size,
+        num_workers=num_workers,
+        collate_fn=_collate,
+    )
+
+    inserted_count = 0
+    pending_rows = []
+    for batch in loader:
+        if batch is None:
+            continue
+        tensors, rel_paths, content_hashes = batch
+        vectors = extractor.embed_tensors(tensors)
+        pending_rows.extend(
+            {"vector": vector, "filepath": rel_path, "content_hash": content_hash}
+            for vector, rel_path, content_hash in zip(vectors, rel_paths, content_hashes)
+        )
+        if len(pending_rows) >= insert_batch_size:
+            milvus_client.insert(collection_name, pending_rows)
+            inserted_count += len(pending_rows)
+            pending_rows = []
+            logger.info(f"Inserted {inserted_count} images so far")
+
+    if pending_rows:
+        milvus_client.insert(collection_name, pending_rows)
+        inserted_count += len(pending_rows)
+
+    return inserted_count
+
+
+if __name__ == "__main__":
+    # 加载环境变量配置
+    load_env_config("../.env")
+
+    # 从环境变量读取配置
+    milvus_uri = os.environ.get("MILVUS_URI", "http://localhost:19530")
+    token = os.environ.get("MILVUS_TOKEN", "")
+    collection_name = os.environ.get("IMAGE_COLLECTION_NAME", "image_embeddings")
+
+    extractor = FeatureExtractor("resnet34")
+
+    # 初始化Milvus客户端
+    milvus_client = MilvusClient(uri=milvus_uri, token=token)
+    logger.info(f"Connected to Milvus: {milvus_uri} successfully")
+
+    # Create a collection with the configured vector index
+    if milvus_client.has_collection(collection_name=collection_name):
+        milvus_client.drop_collection(collection_name=collection_name)
+        logger.info(f"Dropped existing collection: {collection_name}")
+
+    create_image_collection(milvus_client, collection_name, dimension=512)
+    logger.info(f"Created collection: {collection_name} with dimension 512")
+
+
+    root = os.environ.get("TRAIN_IMAGE_ROOT_PATH", "E:/Github_Self/tutorial/milvus/python/uploads/preset/images")
+
+
+    logger.info(f"Starting image feature extraction and insertion from: {root}/train")
+    inserted_count = index_images(
+        milvus_client,
+        extractor,
+        collection_name,
+        root,
+        batch_size=int(os.environ.get("INDEX_BATCH_SIZE", "64")),
+        num_workers=int(os.environ.get("INDEX_NUM_WORKERS", str(max(1, (os.cpu_count() or 2) // 2)))),
+        insert_batch_size=int(os.environ.get("INDEX_INSERT_BATCH_SIZE", "512")),
+    )
+
+    logger.info(f"Image training completed. Total images inserted: {inserted_count}")
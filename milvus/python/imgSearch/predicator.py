@@ -1,18 +1,204 @@
+import json
 import os
 import sys
 
+import torch
 from pymilvus import MilvusClient
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from imgSearch.feature_extractor import FeatureExtractor
+from imgSearch.query_cache import file_digest, get_query_cache
+from utils.collection_cache import collection_cache
 from utils.env_utils import load_env_config
+from utils.index_config import build_search_params, load_index_config
 from utils.logger_util import setup_logging
 
 # 设置日志器
 logger = setup_logging('imgSearch.predicator')
 
 
-def get_similar_image_paths(query_image_path, milvus_client, extractor, collection_name, top_k=10):
+def _format_hits(hits):
+    """将一次查询的检索结果转换为包含路径和相似度的字典列表"""
+    similar_image_paths = []
+    for hit in hits:
+        # 尝试获取filepath字段，如果不存在则使用filename字段
+        file_path = hit["entity"].get("filepath", hit["entity"].get("filename"))
+        distance = hit["distance"]
+        similarity = 1 - distance  
+        
+        logger.debug(f"Similar image found: {file_path} (distance: {distance:.4f}, similarity: {similarity:.4f})")
+        
+        similar_image_paths.append({
+            "path": file_path,
+            "abs_path": os.path.join(os.environ.get('TRAIN_IMAGE_ROOT_PATH'), file_path),
+            "distance": distance,
+            "similarity": similarity
+        })
+    return similar_image_paths
+
+
+def _record_error(errors, i, path, error):
+    """记录第 i 张图片的错误；调用方未传入 errors 时直接抛出"""
+    if errors is None:
+        raise error
+    logger.warning(f"Skipping query image {path}: {str(error)}")
+    errors[i] = str(error)
+
+
+def get_query_vectors(query_image_paths, milvus_client, extractor, collection_name, batch_size=64, errors=None):
+    """
+    批量获取查询图片的特征向量：缓存和集合中已有的直接复用，其余图片分批一次前向推理
+    
+    Args:
+        query_image_paths: 查询图像路径列表
+        milvus_client: Milvus客户端实例
+        extractor: 特征提取器实例
+        collection_name: 集合名称
+        batch_size: 每次前向推理的图片数量
+        errors: 可选字典，无法读取的图片以 {序号: 错误信息} 写入且向量为None；为空时遇到错误直接抛出
+    
+    Returns:
+        list: 与输入顺序一致的向量列表
+    """
+    query_cache = get_query_cache()
+    # 集合中已入库向量的查找与本地缓存相互独立，关闭缓存不影响查找
+    vector_lookup = os.environ.get("IMAGE_VECTOR_LOOKUP", "true").lower() == "true"
+    vectors = [None] * len(query_image_paths)
+    digests = [None] * len(query_image_paths)
+
+    if query_cache is not None or vector_lookup:
+        for i, path in enumerate(query_image_paths):
+            try:
+                digests[i] = file_digest(path)
+            except OSError as e:
+                _record_error(errors, i, path, e)
+                continue
+            if query_cache is not None:
+                vectors[i] = query_cache.get(extractor.modelname, extractor.backend, digests[i])
+
+        # 一次查询取回集合中同内容图片的向量
+        missing = sorted({digests[i] for i, vector in enumerate(vectors) if vector is None and digests[i]})
+        indexed = {}
+        if missing and vector_lookup:
+            try:
+                for start in range(0, len(missing), 1000):
+                    part = missing[start:start + 1000]
+                    rows = milvus_client.query(
+                        collection_name,
+                        filter=f"content_hash in {json.dumps(part)}",
+                        output_fields=["vector", "content_hash"],
+                        limit=len(part),
+                    )
+                    indexed.update({row["content_hash"]: row["vector"] for row in rows})
+            except Exception as e:
+                logger.warning(f"Failed to look up indexed vectors: {str(e)}")
+            for i, digest in enumerate(digests):
+                if vectors[i] is None and digest in indexed:
+                    vectors[i] = indexed[digest]
+                    if query_cache is not None:
+                        query_cache.put(extractor.modelname, extractor.backend, digest, vectors[i])
+
+    pending = [i for i, vector in enumerate(vectors) if vector is None and not (errors and i in errors)]
+    logger.info(f"Extracting features for {len(pending)} of {len(query_image_paths)} query images")
+    for start in range(0, len(pending), batch_size):
+        # 逐张预处理，无法读取的图片只影响自己，不会让整批推理失败
+        positions = []
+        tensors = []
+        for i in pending[start:start + batch_size]:
+            try:
+                tensors.append(extractor.load_image(query_image_paths[i]))
+                positions.append(i)
+            except Exception as e:
+                _record_error(errors, i, query_image_paths[i], e)
+        if not tensors:
+            continue
+        for i, vector in zip(positions, extractor.embed_tensors(torch.stack(tensors))):
+            vectors[i] = vector
+            if query_cache is not None:
+                query_cache.put(extractor.modelname, extractor.backend, digests[i], vector)
+    return vectors
+
+
+def get_query_vector(query_image_path, milvus_client, extractor, collection_name):
+    """获取单张查询图片的特征向量，查找顺序同 get_query_vectors"""
+    return get_query_vectors([query_image_path], milvus_client, extractor, collection_name)[0]
+
+
+def get_similar_image_paths_batch(query_image_paths, milvus_client, extractor, collection_name, top_k=10,
+                                  batch_size=None, search_batch_size=None, search_params=None, errors=None):
+    """
+    批量获取多张图片的相似图片：批量提取特征后用一次多向量检索完成搜索
+    
+    Args:
+        query_image_paths: 查询图像路径列表
+        milvus_client: Milvus客户端实例
+        extractor: 特征提取器实例
+        collection_name: 集合名称
+        top_k: 每张图片返回的相似图像数量
+        batch_size: 每次前向推理的图片数量，默认读取 IMAGE_EXTRACT_BATCH_SIZE
+        search_batch_size: 每次Milvus检索携带的向量数量，默认读取 IMAGE_SEARCH_BATCH_SIZE
+        search_params: 覆盖默认值的索引检索参数，如 {"ef": 128}，为空时使用 IMAGE_SEARCH_PARAMS
+        errors: 可选字典，无法读取的图片以 {序号: 错误信息} 写入，其结果为空列表
+    
+    Returns:
+        list: 与输入顺序一致，每个元素为该图片的相似图像列表
+    """
+    batch_size = batch_size or int(os.environ.get("IMAGE_EXTRACT_BATCH_SIZE", "64"))
+    search_batch_size = search_batch_size or int(os.environ.get("IMAGE_SEARCH_BATCH_SIZE", "1024"))
+    logger.info(f"Searching similar images for {len(query_image_paths)} query images")
+
+    if not collection_cache.has_collection(milvus_client, collection_name):
+        logger.error(f"Collection {collection_name} does not exist")
+        return [[] for _ in query_image_paths]
+
+    query_features = get_query_vectors(query_image_paths, milvus_client, extractor, collection_name, batch_size,
+                                       errors if errors is not None else {})
+    valid = [i for i, vector in enumerate(query_features) if vector is not None]
+
+    # 多个查询向量放在同一个search请求中，超过单次上限时分段
+    index_type = collection_cache.index_type(milvus_client, collection_name)
+    index_search_params = build_search_params(load_index_config("IMAGE", "COSINE", index_type), search_params)
+    results = [[] for _ in query_image_paths]
+    for start in range(0, len(valid), search_batch_size):
+        positions = valid[start:start + search_batch_size]
+        hits_per_query = milvus_client.search(
+            collection_name,
+            data=[query_features[i] for i in positions],
+            limit=top_k,
+            output_fields=["filepath", "filename"],  # 支持两种可能的字段名
+            search_params=index_search_params,
+        )
+        for i, hits in zip(positions, hits_per_query):
+            results[i] = _format_hits(hits)
+    return results
+
+
+def format_batch_results(results, found, batch_results, errors):
+    """
+    把批量检索结果合并到按输入顺序排列的结果列表，生成批量检索接口的响应，Flask 与 ASGI 入口共用
+
+    Args:
+        results: 每张输入图片一项的结果占位列表，不存在的图片已标记为 error
+        found: 存在的图片 (输入序号, 本地路径) 列表，与 batch_results 一一对应
+        batch_results: get_similar_image_paths_batch 的返回值
+        errors: 传给 get_similar_image_paths_batch 的错误字典，键为 found 中的位置
+
+    Returns:
+        dict: {"status", "message", "data"}
+    """
+    for position, ((i, _), similar_images) in enumerate(zip(found, batch_results)):
+        results[i]["data"] = similar_images
+        if position in errors:
+            results[i].update({"status": "error", "error": errors[position]})
+    return {
+        "status": "success",
+        "message": f"Searched {len(found) - len(errors)} of {len(results)} images",
+        "data": results
+    }
+
+
+def get_similar_image_paths(query_image_path, milvus_client, extractor, collection_name, top_k=10,
+                            search_params=None):
     """
     获取相似图片的路径列表
     
@@ -22,6 +208,7 @@ def get_similar_image_paths(query_image_path, milvus_client, extractor, collecti
         extractor: 特征提取器实例
         collection_name: 集合名称
         top_k: 返回的相似图像数量
+        search_params: 覆盖默认值的索引检索参数，为空时使用 IMAGE_SEARCH_PARAMS
     
     Returns:
         list: 包含相似图像路径和相似度的字典列表
@@ -31,40 +218,25 @@ def get_similar_image_paths(query_image_path, milvus_client, extractor, collecti
     
     try:
         # 检查集合是否存在
-        if not milvus_client.has_collection(collection_name):
+        if not collection_cache.has_collection(milvus_client, collection_name):
             logger.error(f"Collection {collection_name} does not exist")
             return []
         
-        # 提取查询图像特征并搜索
-        query_features = extractor(query_image_path)
+        # 获取查询图像特征（优先使用缓存）并搜索
+        query_features = get_query_vector(query_image_path, milvus_client, extractor, collection_name)
         results = milvus_client.search(
             collection_name,
             data=[query_features],
             limit=top_k,
             output_fields=["filepath", "filename"],  # 支持两种可能的字段名
-            search_params={"metric_type": "COSINE"},
+            search_params=build_search_params(
+                load_index_config("IMAGE", "COSINE", collection_cache.index_type(milvus_client, collection_name)),
+                search_params),
         )
         
         logger.info(f"Found {len(results[0])} similar images")
         
-        # 处理结果
-        similar_image_paths = []
-        for hit in results[0]:
-            # 尝试获取filepath字段，如果不存在则使用filename字段
-            file_path = hit["entity"].get("filepath", hit["entity"].get("filename"))
-            distance = hit["distance"]
-            similarity = 1 - distance  
-            
-            logger.info(f"Similar image found: {file_path} (distance: {distance:.4f}, similarity: {similarity:.4f})")
-            
-            similar_image_paths.append({
-                "path": file_path,
-                "abs_path": os.path.join(os.environ.get('TRAIN_IMAGE_ROOT_PATH'), file_path),
-                "distance": distance,
-                "similarity": similarity
-            })
-        
-        return similar_image_paths
+        return _format_hits(results[0])
         
     except Exception as e:
         logger.error(f"Error during image path search: {str(e)}")
@@ -0,0 +1,176 @@
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.logger_util import setup_logging
+
+# 设置日志器
+logger = setup_logging('imgSearch.query_cache')
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """按块计算文件内容的sha256，同一张图片无论文件名如何都得到相同的键"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class QueryVectorCache:
+    """
+    以 (模型, 推理后端, 图片内容哈希) 为键的查询向量缓存：内存LRU，可选落盘为 .npy 文件
+
+    eager 与 int8/ONNX 等后端产出的向量并不完全相同，不同后端之间不复用缓存
+
+    Args:
+        max_items: 内存中最多保留的向量数量
+        persist_dir: 落盘目录，为空时只使用内存
+        max_disk_items: 落盘目录中最多保留的向量文件数，超出后按修改时间淘汰最早的文件，0表示不限制
+    """
+
+    def __init__(self, max_items=1024, persist_dir=None, max_disk_items=100000):
+        self.max_items = max_items
+        self.persist_dir = persist_dir
+        self.max_disk_items = max_disk_items
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._disk_items = 0
+        self._evicting = False
+        if persist_dir:
+            os.makedirs(persist_dir, exist_ok=True)
+            self._disk_items = len(self._disk_files())
+
+    def _disk_files(self):
+        return [os.path.join(dirpath, filename)
+                for dirpath, _, filenames in os.walk(self.persist_dir)
+                for filename in filenames if filename.endswith(".npy")]
+
+    def _evict_disk(self):
+        """
+        落盘文件数超过上限时，删除最早修改的文件直到剩余上限的90%，多删一些避免每次写入都遍历目录
+
+        计数只统计本进程的写入，多个工作进程共享目录时在淘汰时按实际文件数重新校准
+        """
+        files = []
+        for path in self._disk_files():
+            try:
+                files.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        keep = self.max_disk_items * 9 // 10
+        files.sort()
+        for _, path in files[:max(0, len(files) - keep)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_items = min(len(files), keep)
+
+    def _disk_path(self, model_name, backend, digest):
+        return os.path.join(self.persist_dir, model_name, backend, f"{digest}.npy")
+
+    def get(self, model_name, backend, digest):
+        key = (model_name, backend, digest)
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+                self.memory_hits += 1
+                return vector
+        if self.persist_dir:
+            path = self._disk_path(model_name, backend, digest)
+            if os.path.exists(path):
+                try:
+                    vector = np.load(path)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Ignoring unreadable cached vector {path}: {str(e)}")
+                else:
+                    try:
+                        # 更新修改时间，淘汰时按最近使用保留
+                        os.utime(path)
+                    except OSError:
+                        pass
+                    with self._lock:
+                        self.disk_hits += 1
+                        self._remember(key, vector)
+                    return vector
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _remember(self, key, vector):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_items:
+            self._lru.popitem(last=False)
+
+    def put(self, model_name, backend, digest, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._remember((model_name, backend, digest), vector)
+        if self.persist_dir:
+            path = self._disk_path(model_name, backend, digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            is_new = not os.path.exists(path)
+            # 先写临时文件再改名，避免并发读到写了一半的文件；线程号在不同工作进程间会重复，同时带上进程号
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as file:
+                np.save(file, vector)
+            os.replace(tmp_path, path)
+            if is_new and self.max_disk_items > 0:
+                with self._lock:
+                    self._disk_items += 1
+                    evict = self._disk_items > self.max_disk_items and not self._evicting
+                    if evict:
+                        self._evicting = True
+                # 遍历目录较慢，在锁外淘汰，不阻塞内存命中
+                if evict:
+                    try:
+                        self._evict_disk()
+                    finally:
+                        self._evicting = False
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "memory_items": len(self._lru),
+                "disk_items": self._disk_items,
+                "persist_dir": self.persist_dir,
+            }
+
+
+# 进程内共享的查询向量缓存
+_query_cache = None
+_query_cache_lock = threading.Lock()
+
+
+def get_query_cache():
+    """获取（必要时创建）进程内共享的查询向量缓存，IMAGE_QUERY_CACHE_ENABLED=false 时返回None"""
+    global _query_cache
+    if os.environ.get("IMAGE_QUERY_CACHE_ENABLED", "true").lower() != "true":
+        return None
+    if _query_cache is None:
+        with _query_cache_lock:
+            if _query_cache is None:
+                _query_cache = QueryVectorCache(
+                    max_items=int(os.environ.get("IMAGE_QUERY_CACHE_SIZE", "1024")),
+                    persist_dir=os.environ.get("IMAGE_QUERY_CACHE_DIR", ""),
+                    max_disk_items=int(os.environ.get("IMAGE_QUERY_CACHE_DISK_ITEMS", "100000")),
+                )
+    return _query_cache
@@ -0,0 +1,161 @@
+import os
+import sys
+import threading
+import time
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.logger_util import setup_logging
+
+# 在模块加载时设置默认日志器
+logger = setup_logging('answer.cache')
+
+
+class SemanticAnswerCache:
+    """
+    语义回答缓存：问题向量与历史问题的余弦相似度超过阈值时直接返回历史回答
+
+    每次 invalidate 都会推进集合的代数(generation)。回答前用 generation 取当前代数并传给 store，
+    期间集合被更新过时不再写入，避免基于旧集合生成的回答在失效之后又被写回缓存
+
+    Args:
+        threshold: 命中所需的最小余弦相似度
+        ttl: 缓存条目有效期（秒）
+        max_entries: 每个集合最多保留的条目数，超出后淘汰最早的条目
+    """
+
+    def __init__(self, threshold=0.95, ttl=3600, max_entries=1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # (collection_name, variant) -> {"vectors": (n, dim) 归一化矩阵, "entries": [dict, ...]}
+        self._scopes = {}
+        # 代数计数器：collection_name -> 最近一次失效时的计数，_invalidated_all 为最近一次全部失效时的计数
+        self._counter = 0
+        self._invalidated = {}
+        self._invalidated_all = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _drop_expired(self, scope):
+        bucket = self._scopes.get(scope)
+        if not bucket:
+            return
+        deadline = time.time() - self.ttl
+        keep = [i for i, entry in enumerate(bucket["entries"]) if entry["created_at"] >= deadline]
+        if len(keep) != len(bucket["entries"]):
+            bucket["entries"] = [bucket["entries"][i] for i in keep]
+            bucket["vectors"] = bucket["vectors"][keep]
+
+    def _generation(self, collection_name):
+        return max(self._invalidated_all, self._invalidated.get(collection_name, 0))
+
+    def generation(self, collection_name):
+        """返回集合当前的缓存代数，在检索之前获取，之后原样传给 store"""
+        with self._lock:
+            return self._generation(collection_name)
+
+    def lookup(self, collection_name, vector, variant=None):
+        """
+        查找语义相近的历史回答
+
+        Args:
+            collection_name: 集合名称
+            vector: 问题的嵌入向量
+            variant: 影响回答的其他参数（如LLM模型），不同取值互不命中
+
+        Returns:
+            dict: 命中时返回 {"question", "result", "similarity"}，否则返回None
+        """
+        query = self._normalize(vector)
+        scope = (collection_name, variant)
+        with self._lock:
+            self._drop_expired(scope)
+            bucket = self._scopes.get(scope)
+            if bucket and bucket["entries"] and bucket["vectors"].shape[1] == query.shape[0]:
+                similarities = bucket["vectors"] @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.hits += 1
+                    entry = bucket["entries"][best]
+                    return {"question": entry["question"], "result": entry["result"],
+                            "similarity": float(similarities[best])}
+            self.misses += 1
+            return None
+
+    def store(self, collection_name, question, vector, result, variant=None, generation=None):
+        """
+        保存问题向量及其回答
+
+        Args:
+            generation: 生成回答前 generation() 的返回值；集合在此之后被失效过时不写入
+        """
+        normalized = self._normalize(vector)
+        scope = (collection_name, variant)
+        with self._lock:
+            if generation is not None and generation != self._generation(collection_name):
+                logger.info(f"Collection {collection_name} changed while answering, skip caching the answer")
+                return
+            bucket = self._scopes.get(scope)
+            if bucket is None or bucket["vectors"].shape[1] != normalized.shape[0]:
+                bucket = {"vectors": np.empty((0, normalized.shape[0]), dtype=np.float32), "entries": []}
+                self._scopes[scope] = bucket
+            bucket["vectors"] = np.vstack([bucket["vectors"], normalized])[-self.max_entries:]
+            bucket["entries"] = (bucket["entries"] + [{
+                "question": question,
+                "result": result,
+                "created_at": time.time(),
+            }])[-self.max_entries:]
+
+    def invalidate(self, collection_name=None):
+        """清空指定集合（或全部）的缓存，集合内容变化后调用"""
+        with self._lock:
+            self._counter += 1
+            if collection_name is None:
+                self._invalidated_all = self._counter
+                self._scopes.clear()
+            else:
+                self._invalidated[collection_name] = self._counter
+                for scope in [scope for scope in self._scopes if scope[0] == collection_name]:
+                    del self._scopes[scope]
+        logger.info(f"Invalidated answer cache for {collection_name or 'all collections'}")
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "entries": sum(len(bucket["entries"]) for bucket in self._scopes.values()),
+                "threshold": self.threshold,
+                "ttl": self.ttl,
+            }
+
+
+# 进程内共享的回答缓存，ANSWER_CACHE_ENABLED=false 时关闭
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """获取（必要时创建）进程内共享的语义回答缓存，未启用时返回None"""
+    global _answer_cache
+    if os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() != "true":
+        return None
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = SemanticAnswerCache(
+                    threshold=float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95")),
+                    ttl=float(os.environ.get("ANSWER_CACHE_TTL", "3600")),
+                    max_entries=int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "1000")),
+                )
+    return _answer_cache
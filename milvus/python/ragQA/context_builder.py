@@ -0,0 +1,122 @@
+import os
+import re
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.logger_util import setup_logging
+from utils.token_utils import count_tokens, split_sentences, truncate_tokens
+
+# 在模块加载时设置默认日志器
+logger = setup_logging('qa.context')
+
+# 中文按字、其他语言按单词切分，用于去重和句子相关性打分
+_TERM_PATTERN = re.compile(r"[一-鿿]|[A-Za-z0-9_]+")
+# 计算句子相关性时忽略的常见虚词
+_STOPWORDS = {"a", "an", "the", "is", "are", "was", "were", "be", "to", "of", "in", "on", "for", "and", "or",
+              "how", "what", "why", "when", "which", "who", "do", "does", "can", "i", "it", "this", "that", "with",
+              "的", "了", "是", "在", "和", "吗", "呢", "么", "什", "如", "何"}
+
+
+def load_context_config():
+    """
+    从环境变量读取上下文拼装配置
+
+    Returns:
+        dict: max_tokens 为0时不限制长度；sentence_extraction 为 true 时只保留每个片段中与问题最相关的句子
+    """
+    return {
+        "max_tokens": int(os.environ.get("QA_CONTEXT_MAX_TOKENS", "3000")),
+        "dedup_threshold": float(os.environ.get("QA_CONTEXT_DEDUP_THRESHOLD", "0.8")),
+        "sentence_extraction": os.environ.get("QA_CONTEXT_SENTENCE_EXTRACTION", "false").lower() == "true",
+        "max_sentences": int(os.environ.get("QA_CONTEXT_MAX_SENTENCES", "5")),
+    }
+
+
+def _terms(text):
+    return [term.lower() for term in _TERM_PATTERN.findall(text)]
+
+
+def _shingles(text, size=3):
+    terms = _terms(text)
+    if len(terms) < size:
+        return {tuple(terms)} if terms else set()
+    return {tuple(terms[i:i + size]) for i in range(len(terms) - size + 1)}
+
+
+def _is_duplicate(shingles, kept_shingles, threshold):
+    """较短片段的词组有 threshold 以上出现在已保留片段中时视为重复（包括互相包含、重叠切分）"""
+    if not shingles:
+        return True
+    for other in kept_shingles:
+        overlap = len(shingles & other) / min(len(shingles), len(other) or 1)
+        if overlap >= threshold:
+            return True
+    return False
+
+
+def extract_sentences(question, text, max_sentences):
+    """
+    保留片段中与问题词重合最多的 max_sentences 个句子，按原顺序拼接
+
+    标题行（以 # 开头）始终保留，方便模型判断片段主题
+    """
+    sentences = split_sentences(text)
+    if len(sentences) <= max_sentences:
+        return text
+    question_terms = set(_terms(question)) - _STOPWORDS
+    scored = []
+    for position, sentence in enumerate(sentences):
+        terms = _terms(sentence)
+        score = sum(1 for term in terms if term in question_terms) / (len(terms) ** 0.5 or 1)
+        if sentence.lstrip().startswith("#"):
+            score = float("inf")
+        scored.append((score, position))
+    # 得分相同时优先保留靠前的句子
+    keep = sorted(position for _, position in sorted(scored, key=lambda item: (-item[0], item[1]))[:max_sentences])
+    return " ".join(sentences[position].strip() for position in keep)
+
+
+def build_context(question, retrieved_lines_with_distances, context_config=None):
+    """
+    在token预算内拼装上下文：按得分从高到低依次加入片段，跳过与已加入片段重复的内容，
+    可选只保留每个片段中最相关的句子，预算不足时截断最后一个片段
+
+    Args:
+        question: 用户问题
+        retrieved_lines_with_distances: (文本, 得分) 列表，得分越大越相关
+        context_config: load_context_config 的返回值，为空时读取环境变量
+
+    Returns:
+        list: 放入提示词的片段文本，按得分排序
+    """
+    context_config = context_config or load_context_config()
+    max_tokens = context_config["max_tokens"]
+    ranked = sorted(retrieved_lines_with_distances, key=lambda line: line[1], reverse=True)
+
+    pieces = []
+    kept_shingles = []
+    used_tokens = 0
+    dropped_duplicates = 0
+    for text, _ in ranked:
+        shingles = _shingles(text)
+        if _is_duplicate(shingles, kept_shingles, context_config["dedup_threshold"]):
+            dropped_duplicates += 1
+            continue
+        if context_config["sentence_extraction"]:
+            text = extract_sentences(question, text, context_config["max_sentences"])
+        if max_tokens > 0:
+            tokens = count_tokens(text)
+            remaining = max_tokens - used_tokens
+            if tokens > remaining:
+                # 剩余预算太少时截断出的片段没有意义，直接结束
+                if remaining >= 64:
+                    pieces.append(truncate_tokens(text, remaining))
+                    used_tokens += remaining
+                break
+            used_tokens += tokens
+        pieces.append(text)
+        kept_shingles.append(shingles)
+
+    logger.info(f"Context uses {len(pieces)} of {len(ranked)} chunks "
+                f"({used_tokens if max_tokens > 0 else 'unbounded'} tokens, {dropped_duplicates} duplicates dropped)")
+    return pieces
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 import sys
@@ -5,15 +6,156 @@ from pymilvus import MilvusClient
 from openai import OpenAI
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils.embedding_utils import embed_text
+from ragQA.answer_cache import get_answer_cache
+from ragQA.context_builder import build_context
+from ragQA.retrieval import SPARSE_FIELD, candidate_limit, hybrid_search_kwargs, load_retrieval_config, rerank
+from utils.collection_cache import collection_cache
+from utils.embedding_utils import embed_text, async_embed_text
 from utils.env_utils import load_env_config
+from utils.index_config import build_search_params, load_index_config
 from utils.logger_util import setup_logging
 
 # 在模块加载时设置默认日志器
 logger = setup_logging('qa.rag')
 
+# 定义提示词
+SYSTEM_PROMPT = """
+    Human: You are an AI assistant. You are able to find answers to the questions from the contextual passage snippets provided.
+    """
+
+
+def _search_kwargs(collection_name, question_vector, grab_top_n_res, search_params=None, index_type=None):
+    """
+    同步与异步Milvus客户端共用的检索参数，search_params 为单次请求覆盖的索引检索参数（如 ef、nprobe），
+    index_type 为集合上实际构建的索引类型
+    """
+    return dict(
+        collection_name=collection_name,
+        data=[
+            question_vector
+        ],  
+        limit=grab_top_n_res, 
+        search_params=build_search_params(load_index_config("QA", "IP", index_type), search_params), 
+        output_fields=["text"], 
+    )
+
+
+def _parse_hits(search_res):
+    """将检索结果转换为 (文本, 距离) 列表"""
+    return [
+        (res["entity"]["text"], res["distance"]) for res in search_res[0]
+    ]
+
+
+def _has_sparse_field(schema, collection_name):
+    """hybrid 模式需要集合带有 BM25 稀疏向量字段，旧集合退回纯稠密检索"""
+    if not collection_cache.has_field(schema, SPARSE_FIELD):
+        logger.warning(f"Collection {collection_name} has no {SPARSE_FIELD} field, falling back to dense retrieval")
+        return False
+    return True
+
+
+def _retrieve(milvus_client, collection_name, question, question_vector, grab_top_n_res, search_params=None):
+    """
+    在集合中检索与问题最相关的文本，返回 (文本, 距离) 列表
+
+    QA_RETRIEVAL_MODE=hybrid 时同时做稠密检索和BM25检索并融合排序；配置 QA_RERANK_MODEL 时
+    先取回更大的候选集，再用交叉编码器重排后截取前 grab_top_n_res 条
+    """
+    retrieval_config = load_retrieval_config()
+    limit = candidate_limit(retrieval_config, grab_top_n_res)
+    index_type = collection_cache.index_type(milvus_client, collection_name)
+    # 只有 hybrid 模式才需要读取集合schema，纯稠密检索不调用 describe
+    use_hybrid = retrieval_config["mode"] == "hybrid" and _has_sparse_field(
+        collection_cache.describe(milvus_client, collection_name), collection_name)
+    if use_hybrid:
+        search_res = milvus_client.hybrid_search(**hybrid_search_kwargs(
+            collection_name, question, question_vector, limit, retrieval_config, search_params, index_type))
+    else:
+        search_res = milvus_client.search(**_search_kwargs(collection_name, question_vector, limit, search_params,
+                                                           index_type))
+    return rerank(question, _parse_hits(search_res), grab_top_n_res, retrieval_config)
+
+
+async def _async_retrieve(async_milvus_client, collection_name, question, question_vector, grab_top_n_res,
+                          search_params=None):
+    retrieval_config = load_retrieval_config()
+    limit = candidate_limit(retrieval_config, grab_top_n_res)
+    index_type = await collection_cache.async_index_type(async_milvus_client, collection_name)
+    use_hybrid = retrieval_config["mode"] == "hybrid" and _has_sparse_field(
+        await collection_cache.async_describe(async_milvus_client, collection_name), collection_name)
+    if use_hybrid:
+        search_res = await async_milvus_client.hybrid_search(**hybrid_search_kwargs(
+            collection_name, question, question_vector, limit, retrieval_config, search_params, index_type))
+    else:
+        search_res = await async_milvus_client.search(**_search_kwargs(collection_name, question_vector, limit,
+                                                                       search_params, index_type))
+    # 交叉编码器推理是CPU密集操作，放到线程池中执行
+    return await asyncio.to_thread(rerank, question, _parse_hits(search_res), grab_top_n_res, retrieval_config)
+
+
+def _cache_variant(llm_model, grab_top_n_res, search_params):
+    """影响回答的参数，取值不同的请求互不命中语义回答缓存"""
+    return llm_model, grab_top_n_res, json.dumps(search_params or {}, sort_keys=True)
+
+
+def _cached_answer(collection_name, question_vector, variant):
+    """
+    查找语义相近问题的缓存回答
+
+    Returns:
+        tuple: (generation, cached)；generation 在检索之前获取，原样传给 _store_answer，
+               检索期间集合被更新时不缓存这次的回答；缓存未启用时均为None
+    """
+    answer_cache = get_answer_cache()
+    if answer_cache is None:
+        return None, None
+    generation = answer_cache.generation(collection_name)
+    cached = answer_cache.lookup(collection_name, question_vector, variant=variant)
+    if cached is not None:
+        logger.info(f"Answer cache hit (similarity {cached['similarity']:.4f}) for question: {cached['question']}")
+    return generation, cached
+
+
+def _store_answer(collection_name, question, question_vector, result, variant, generation):
+    """写入语义回答缓存，generation 为 _cached_answer 的返回值，为None（未使用缓存）时不写入"""
+    answer_cache = get_answer_cache()
+    if answer_cache is not None and generation is not None:
+        answer_cache.store(collection_name, question, question_vector, result, variant=variant,
+                           generation=generation)
+
+
+def _cached_events(cached):
+    """把缓存命中的回答转换为流式接口的事件序列"""
+    return [
+        {"event": "sources", "data": {"sources": cached["result"]["sources"], "cached": True}},
+        {"event": "token", "data": {"content": cached["result"]["response"]}},
+        {"event": "done", "data": {"cached": True}},
+    ]
+
+
+def _build_messages(question, retrieved_lines_with_distances):
+    """根据检索结果构建发送给LLM的消息"""
+    # 在token预算内构建上下文（去重、按得分裁剪，可选抽取相关句子）
+    context = "\n".join(build_context(question, retrieved_lines_with_distances))
+
+    USER_PROMPT = f"""
+    Use the following pieces of information enclosed in <context> tags to provide an answer to the question enclosed in <question> tags.
+    <context>
+    {context}
+    </context>
+    <question>
+    {question}
+    </question>
+    """
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": USER_PROMPT},
+    ]
+
+
 def answer_question(question, milvus_client, openai_client, collection_name, embedding_model="text-embedding-v4", 
-                    grab_top_n_res=5, llm_model="gpt-3.5-turbo"):
+                    grab_top_n_res=5, llm_model="gpt-3.5-turbo", use_cache=True, search_params=None):
     """
     回答用户问题
     
@@ -25,61 +167,173 @@ def answer_question(question, milvus_client, openai_client, collection_name, emb
         embedding_model: 嵌入模型名称
         grab_top_n_res: 检索结果数量
         llm_model: LLM模型名称
+        use_cache: 是否使用语义回答缓存
+        search_params: 覆盖默认值的索引检索参数，如 {"ef": 128}，为空时使用 QA_SEARCH_PARAMS
     
     Returns:
-        dict: 包含回答和检索源的字典
+        dict: 包含回答、检索源以及是否命中缓存的字典
     """
     logger.info(f"Answering question: {question}")
     logger.info(f"Using collection: {collection_name}")
 
+    question_vector = embed_text(openai_client, question, embedding_model)
+
+    # 语义相近的问题直接复用缓存的回答
+    cache_variant = _cache_variant(llm_model, grab_top_n_res, search_params)
+    generation, cached = _cached_answer(collection_name, question_vector, cache_variant) if use_cache else (None, None)
+    if cached is not None:
+        return {**cached["result"], "cached": True}
+
     # 搜索相似文本
-    search_res = milvus_client.search(
-        collection_name=collection_name,
-        data=[
-            embed_text(openai_client, question, embedding_model)
-        ],  
-        limit=grab_top_n_res, 
-        search_params={"metric_type": "IP", "params": {}}, 
-        output_fields=["text"], 
+    retrieved_lines_with_distances = _retrieve(milvus_client, collection_name, question, question_vector,
+                                                grab_top_n_res, search_params)
+
+    # 获取LLM回答
+    response = openai_client.chat.completions.create(
+        model=llm_model,
+        messages=_build_messages(question, retrieved_lines_with_distances),
     )
 
-    # 处理检索结果
-    retrieved_lines_with_distances = [
-        (res["entity"]["text"], res["distance"]) for res in search_res[0]
-    ]
+    result = {
+        "response": response.choices[0].message.content,
+        "sources": retrieved_lines_with_distances
+    }
+    _store_answer(collection_name, question, question_vector, result, cache_variant, generation)
+
+    return {**result, "cached": False}
+
+
+def stream_answer_question(question, milvus_client, openai_client, collection_name, embedding_model="text-embedding-v4",
+                           grab_top_n_res=5, llm_model="gpt-3.5-turbo", use_cache=True, search_params=None):
+    """
+    以流式方式回答用户问题：先产出检索源，再逐段产出LLM生成的内容
+    
+    Args:
+        与 answer_question 相同
+    
+    Yields:
+        dict: {"event": "sources" | "token" | "done", "data": ...}
+    """
+    logger.info(f"Streaming answer for question: {question}")
+    logger.info(f"Using collection: {collection_name}")
+
+    question_vector = embed_text(openai_client, question, embedding_model)
+
+    cache_variant = _cache_variant(llm_model, grab_top_n_res, search_params)
+    generation, cached = _cached_answer(collection_name, question_vector, cache_variant) if use_cache else (None, None)
+    if cached is not None:
+        yield from _cached_events(cached)
+        return
+
+    retrieved_lines_with_distances = _retrieve(milvus_client, collection_name, question, question_vector,
+                                                grab_top_n_res, search_params)
+    yield {"event": "sources", "data": {"sources": retrieved_lines_with_distances, "cached": False}}
 
-    # 构建上下文
-    context = "\n".join(
-        [line_with_distance[0] for line_with_distance in retrieved_lines_with_distances]
+    stream = openai_client.chat.completions.create(
+        model=llm_model,
+        messages=_build_messages(question, retrieved_lines_with_distances),
+        stream=True,
     )
+    pieces = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        content = chunk.choices[0].delta.content
+        if content:
+            pieces.append(content)
+            yield {"event": "token", "data": {"content": content}}
 
-    # 定义提示词
-    SYSTEM_PROMPT = """
-    Human: You are an AI assistant. You are able to find answers to the questions from the contextual passage snippets provided.
+    # 完整生成后才写入缓存，中途断开的回答不会被缓存
+    result = {"response": "".join(pieces), "sources": retrieved_lines_with_distances}
+    _store_answer(collection_name, question, question_vector, result, cache_variant, generation)
+    yield {"event": "done", "data": {"cached": False}}
+
+
+async def async_answer_question(question, async_milvus_client, async_openai_client, collection_name,
+                                embedding_model="text-embedding-v4", grab_top_n_res=5, llm_model="gpt-3.5-turbo",
+                                use_cache=True, embedding_client=None, search_params=None):
     """
-    USER_PROMPT = f"""
-    Use the following pieces of information enclosed in <context> tags to provide an answer to the question enclosed in <question> tags.
-    <context>
-    {context}
-    </context>
-    <question>
-    {question}
-    </question>
+    answer_question 的异步版本，等待嵌入、检索和LLM时不占用线程
+    
+    Args:
+        async_milvus_client: AsyncMilvusClient实例
+        async_openai_client: AsyncOpenAI客户端实例
+        embedding_client: customize 嵌入后端使用的 AsyncEmbeddingClient
+        其余参数与 answer_question 相同
+    
+    Returns:
+        dict: 包含回答、检索源以及是否命中缓存的字典
     """
+    logger.info(f"Answering question: {question}")
+    logger.info(f"Using collection: {collection_name}")
 
-    # 获取LLM回答
-    response = openai_client.chat.completions.create(
+    question_vector = await async_embed_text(async_openai_client, question, embedding_model, embedding_client)
+
+    cache_variant = _cache_variant(llm_model, grab_top_n_res, search_params)
+    generation, cached = _cached_answer(collection_name, question_vector, cache_variant) if use_cache else (None, None)
+    if cached is not None:
+        return {**cached["result"], "cached": True}
+
+    retrieved_lines_with_distances = await _async_retrieve(async_milvus_client, collection_name,
+                                                           question, question_vector, grab_top_n_res, search_params)
+
+    response = await async_openai_client.chat.completions.create(
         model=llm_model,
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": USER_PROMPT},
-        ],
+        messages=_build_messages(question, retrieved_lines_with_distances),
     )
 
-    return {
+    result = {
         "response": response.choices[0].message.content,
         "sources": retrieved_lines_with_distances
     }
+    _store_answer(collection_name, question, question_vector, result, cache_variant, generation)
+
+    return {**result, "cached": False}
+
+
+async def async_stream_answer_question(question, async_milvus_client, async_openai_client, collection_name,
+                                       embedding_model="text-embedding-v4", grab_top_n_res=5,
+                                       llm_model="gpt-3.5-turbo", use_cache=True, embedding_client=None,
+                                       search_params=None):
+    """
+    stream_answer_question 的异步版本，参数与 async_answer_question 相同
+    
+    Yields:
+        dict: {"event": "sources" | "token" | "done", "data": ...}
+    """
+    logger.info(f"Streaming answer for question: {question}")
+    logger.info(f"Using collection: {collection_name}")
+
+    question_vector = await async_embed_text(async_openai_client, question, embedding_model, embedding_client)
+
+    cache_variant = _cache_variant(llm_model, grab_top_n_res, search_params)
+    generation, cached = _cached_answer(collection_name, question_vector, cache_variant) if use_cache else (None, None)
+    if cached is not None:
+        for event in _cached_events(cached):
+            yield event
+        return
+
+    retrieved_lines_with_distances = await _async_retrieve(async_milvus_client, collection_name,
+                                                           question, question_vector, grab_top_n_res, search_params)
+    yield {"event": "sources", "data": {"sources": retrieved_lines_with_distances, "cached": False}}
+
+    stream = await async_openai_client.chat.completions.create(
+        model=llm_model,
+        messages=_build_messages(question, retrieved_lines_with_distances),
+        stream=True,
+    )
+    pieces = []
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        content = chunk.choices[0].delta.content
+        if content:
+            pieces.append(content)
+            yield {"event": "token", "data": {"content": content}}
+
+    result = {"response": "".join(pieces), "sources": retrieved_lines_with_distances}
+    _store_answer(collection_name, question, question_vector, result, cache_variant, generation)
+    yield {"event": "done", "data": {"cached": False}}
 
 
 # 以下为直接运行此脚本时的示例代码
@@ -0,0 +1,114 @@
+import os
+import sys
+import threading
+
+from pymilvus import AnnSearchRequest, RRFRanker, WeightedRanker
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.index_config import build_search_params, load_index_config
+from utils.logger_util import setup_logging
+
+# 在模块加载时设置默认日志器
+logger = setup_logging('qa.retrieval')
+
+# 问答集合中由 BM25 函数根据 text 字段自动生成的稀疏向量字段
+SPARSE_FIELD = "sparse"
+
+
+def load_retrieval_config():
+    """
+    从环境变量读取检索配置
+
+    Returns:
+        dict: mode 为 dense 或 hybrid；fusion 为 rrf 或 weighted；rerank_model 为空时不重排
+    """
+    mode = os.environ.get("QA_RETRIEVAL_MODE", "dense").lower()
+    fusion = os.environ.get("QA_HYBRID_FUSION", "rrf").lower()
+    if mode not in ("dense", "hybrid"):
+        raise ValueError(f"Unsupported QA_RETRIEVAL_MODE: {mode}, expected dense or hybrid")
+    if fusion not in ("rrf", "weighted"):
+        raise ValueError(f"Unsupported QA_HYBRID_FUSION: {fusion}, expected rrf or weighted")
+    return {
+        "mode": mode,
+        "fusion": fusion,
+        "rrf_k": int(os.environ.get("QA_RRF_K", "60")),
+        "dense_weight": float(os.environ.get("QA_DENSE_WEIGHT", "0.7")),
+        "sparse_weight": float(os.environ.get("QA_SPARSE_WEIGHT", "0.3")),
+        "rerank_model": os.environ.get("QA_RERANK_MODEL", ""),
+        "candidate_pool": int(os.environ.get("QA_CANDIDATE_POOL", "0")),
+    }
+
+
+def candidate_limit(retrieval_config, grab_top_n_res):
+    """重排时先取回更大的候选集（默认 4 倍），否则直接取 top N"""
+    if not retrieval_config["rerank_model"]:
+        return grab_top_n_res
+    return max(grab_top_n_res, retrieval_config["candidate_pool"] or 4 * grab_top_n_res)
+
+
+def hybrid_search_kwargs(collection_name, question, question_vector, limit, retrieval_config, search_params=None,
+                         index_type=None):
+    """稠密向量检索与 BM25 全文检索的 hybrid_search 参数，同步与异步客户端共用；index_type 为集合上实际构建的索引类型"""
+    dense_request = AnnSearchRequest(
+        data=[question_vector],
+        anns_field="vector",
+        param=build_search_params(load_index_config("QA", "IP", index_type), search_params),
+        limit=limit,
+    )
+    # BM25 检索直接传入原始问题文本，由Milvus分词并计算稀疏向量
+    sparse_request = AnnSearchRequest(
+        data=[question],
+        anns_field=SPARSE_FIELD,
+        param={"metric_type": "BM25", "params": {}},
+        limit=limit,
+    )
+    if retrieval_config["fusion"] == "rrf":
+        ranker = RRFRanker(retrieval_config["rrf_k"])
+    else:
+        ranker = WeightedRanker(retrieval_config["dense_weight"], retrieval_config["sparse_weight"])
+    return dict(
+        collection_name=collection_name,
+        reqs=[dense_request, sparse_request],
+        ranker=ranker,
+        limit=limit,
+        output_fields=["text"],
+    )
+
+
+_rerankers = {}
+_rerankers_lock = threading.Lock()
+
+
+def get_reranker(model_name):
+    """
+    获取（必要时加载）本地交叉编码器，sentence-transformers 为可选依赖
+
+    Returns:
+        CrossEncoder 或 None（未安装依赖或加载失败时）
+    """
+    if model_name not in _rerankers:
+        with _rerankers_lock:
+            if model_name not in _rerankers:
+                try:
+                    from sentence_transformers import CrossEncoder
+                    _rerankers[model_name] = CrossEncoder(model_name)
+                    logger.info(f"Loaded reranker {model_name}")
+                except Exception as e:
+                    logger.warning(f"Failed to load reranker {model_name}, skipping reranking: {str(e)}")
+                    _rerankers[model_name] = None
+    return _rerankers[model_name]
+
+
+def rerank(question, retrieved_lines_with_distances, grab_top_n_res, retrieval_config):
+    """
+    用交叉编码器对候选文本重新打分并截取前 N 条
+
+    Returns:
+        list: (文本, 得分) 列表；未配置重排模型时原样截取
+    """
+    reranker = get_reranker(retrieval_config["rerank_model"]) if retrieval_config["rerank_model"] else None
+    if reranker is None or not retrieved_lines_with_distances:
+        return retrieved_lines_with_distances[:grab_top_n_res]
+    scores = reranker.predict([(question, text) for text, _ in retrieved_lines_with_distances])
+    ranked = sorted(zip(retrieved_lines_with_distances, scores), key=lambda item: item[1], reverse=True)
+    return [(text, float(score)) for (text, _), score in ranked[:grab_top_n_res]]
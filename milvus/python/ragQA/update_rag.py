@@ -1,112 +1,399 @@
+import glob
+import hashlib
+import json
 import time
 import os
 import sys
-from tqdm import tqdm
-from pymilvus import MilvusClient
+from pymilvus import MilvusClient, DataType, Function, FunctionType
 from openai import OpenAI
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils.embedding_utils import embed_text
-from utils.read_file_utils import read_markdown
+from ragQA.answer_cache import get_answer_cache
+from ragQA.retrieval import SPARSE_FIELD
+from utils.collection_cache import collection_cache
+from utils.embedding_utils import embed_in_batches
+from utils.index_config import add_vector_index, load_index_config
+from utils.read_file_utils import iter_document_files
 from utils.env_utils import load_env_config
 from utils.logger_util import setup_logging
 
 # 在模块加载时设置默认日志器
 logger = setup_logging('update.rag')
 
+# 每次写入Milvus的块数量，同时也是内存中最多保留的向量数量
+DEFAULT_INSERT_BATCH_SIZE = int(os.environ.get("INSERT_BATCH_SIZE", "256"))
+
+# 集合中VARCHAR字段的最大长度（字节）
+MAX_TEXT_LENGTH = 65535
+MAX_SOURCE_LENGTH = 1024
+
+
+def _batched(iterable, batch_size):
+    """将可迭代对象按固定大小分组产出"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _truncate_utf8(text, max_bytes):
+    """按UTF-8字节数截断字符串，避免超过VARCHAR字段长度"""
+    encoded = text.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return text
+    logger.warning(f"Truncating chunk of {len(encoded)} bytes to {max_bytes} bytes")
+    return encoded[:max_bytes].decode("utf-8", errors="ignore")
+
+
+def _chunk_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _chunk_id(source, chunk_hash, occurrence):
+    """由 来源+内容哈希+重复序号 派生稳定的INT64主键"""
+    digest = hashlib.sha256(f"{source}\0{chunk_hash}\0{occurrence}".encode("utf-8")).hexdigest()
+    return int(digest[:15], 16)
+
+
+def _section_id(source, section):
+    """由 来源+段落序号 派生稳定的INT64主键，upgrade 模式续传或重跑时同一块得到同一个ID"""
+    digest = hashlib.sha256(f"{source}\0section\0{section}".encode("utf-8")).hexdigest()
+    return int(digest[:15], 16)
+
+
+def _quote(value):
+    """生成Milvus过滤表达式中的字符串字面量"""
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _iter_chunk_records(doc_path, source=None, failures=None, section_counts=None):
+    """
+    读取文档并为每个文本块附加来源与段落序号
+
+    Args:
+        doc_path: 文档路径或glob模式
+        source: 来源名称，默认使用文件路径
+        failures: 可选列表，收集解析失败的文件
+        section_counts: 可选字典，以 {来源: 块数量} 记录成功解析的每个来源
+
+    Yields:
+        dict: {"source", "section", "heading", "text"}
+    """
+    for file_path, chunks in iter_document_files(doc_path, failures=failures):
+        if section_counts is not None:
+            section_counts[source or file_path] = len(chunks)
+        for section, chunk in enumerate(chunks):
+            yield {"source": source or file_path, "section": section, "heading": chunk["heading"],
+                   "text": chunk["text"]}
+
+
+def _to_row(record, row_id, vector):
+    return {
+        "id": row_id,
+        "vector": vector,
+        "text": _truncate_utf8(record["text"], MAX_TEXT_LENGTH),
+        "source": _truncate_utf8(record["source"], MAX_SOURCE_LENGTH),
+        "section": record["section"],
+        "heading": _truncate_utf8(record["heading"], MAX_SOURCE_LENGTH),
+        "chunk_hash": _chunk_hash(record["text"]),
+    }
+
+
+def _create_qa_collection(milvus_client, collection_name, embedding_dim):
+    """
+    创建问答集合，除向量和文本外显式保存来源、段落序号、标题路径和内容哈希，供增量同步使用
+
+    QA_SPARSE_ENABLED 为 true（默认）时对 text 启用分词，并由 BM25 函数在写入时自动生成稀疏向量，
+    供 hybrid 检索使用；Milvus 2.5 之前的版本不支持，需要设置为 false
+    """
+    sparse_enabled = os.environ.get("QA_SPARSE_ENABLED", "true").lower() == "true"
+    schema = milvus_client.create_schema(auto_id=False, enable_dynamic_field=True)
+    schema.add_field(field_name="id", datatype=DataType.INT64, is_primary=True)
+    schema.add_field(field_name="vector", datatype=DataType.FLOAT_VECTOR, dim=embedding_dim)
+    schema.add_field(field_name="text", datatype=DataType.VARCHAR, max_length=MAX_TEXT_LENGTH,
+                     enable_analyzer=sparse_enabled)
+    schema.add_field(field_name="source", datatype=DataType.VARCHAR, max_length=MAX_SOURCE_LENGTH)
+    schema.add_field(field_name="section", datatype=DataType.INT64)
+    schema.add_field(field_name="heading", datatype=DataType.VARCHAR, max_length=MAX_SOURCE_LENGTH)
+    schema.add_field(field_name="chunk_hash", datatype=DataType.VARCHAR, max_length=64)
+    if sparse_enabled:
+        schema.add_field(field_name=SPARSE_FIELD, datatype=DataType.SPARSE_FLOAT_VECTOR)
+        schema.add_function(Function(
+            name="text_bm25",
+            function_type=FunctionType.BM25,
+            input_field_names=["text"],
+            output_field_names=[SPARSE_FIELD],
+        ))
+
+    # 索引类型和构建参数由 QA_INDEX_TYPE / QA_INDEX_PARAMS 配置，默认 AUTOINDEX
+    index_config = load_index_config("QA", "IP")
+    index_params = add_vector_index(milvus_client.prepare_index_params(), "vector", index_config)
+    logger.info(f"Creating {index_config['index_type']} index with params {index_config['index_params']}")
+    if sparse_enabled:
+        index_params.add_index(field_name=SPARSE_FIELD, index_type="SPARSE_INVERTED_INDEX", metric_type="BM25")
+
+    milvus_client.create_collection(
+        collection_name=collection_name,
+        schema=schema,
+        index_params=index_params,
+        consistency_level="Bounded",
+    )
+
+
+def _query_all(milvus_client, collection_name, filter, output_fields, batch_size=1000):
+    """用查询迭代器取回所有满足条件的实体，不受单次查询条数限制"""
+    iterator = milvus_client.query_iterator(
+        collection_name=collection_name,
+        batch_size=batch_size,
+        filter=filter,
+        output_fields=output_fields,
+    )
+    results = []
+    try:
+        while True:
+            batch = iterator.next()
+            if not batch:
+                break
+            results.extend(batch)
+    finally:
+        iterator.close()
+    return results
+
+
+def _iter_embedded_batches(records, openai_client, embedding_model, start_id, batch_size, resume_from=0):
+    """
+    分批为文本块生成嵌入，产出可直接写入Milvus的行
+
+    Args:
+        records: 文本块记录迭代器
+        openai_client: OpenAI客户端实例
+        embedding_model: 嵌入模型名称
+        start_id: 第一个块的ID，为None时由 来源+段落序号 派生
+        batch_size: 每批块数量
+        resume_from: 跳过的已处理块数量
+
+    Yields:
+        tuple: (已处理到的块序号, 行列表)
+    """
+    indexed_records = ((i, record) for i, record in enumerate(records) if i >= resume_from)
+    for batch in _batched(indexed_records, batch_size):
+        vectors = embed_in_batches(openai_client, [record["text"] for _, record in batch], embedding_model)
+        rows = [
+            _to_row(record, _section_id(record["source"], record["section"]) if start_id is None else start_id + i,
+                    vector)
+            for (i, record), vector in zip(batch, vectors)
+        ]
+        yield batch[-1][0] + 1, rows
+
+
+def _insert_streaming(milvus_client, collection_name, records, openai_client, embedding_model,
+                      start_id, insert_batch_size, resume_from=0):
+    """
+    流式执行 读取 → 嵌入 → 写入，每批写入后记录进度
+
+    start_id 为None时主键由 来源+段落序号 派生并以 upsert 写入，续传或重跑不会产生重复或错位的ID
+
+    Returns:
+        int: 本次写入的块数量
+    """
+    inserted = 0
+    processed = resume_from
+    write = milvus_client.upsert if start_id is None else milvus_client.insert
+    try:
+        for processed, rows in _iter_embedded_batches(records, openai_client, embedding_model,
+                                                      start_id, insert_batch_size, resume_from):
+            write(collection_name=collection_name, data=rows)
+            inserted += len(rows)
+            logger.info(f"Inserted {inserted} chunks into {collection_name} "
+                        f"(processed {processed} chunks, last id {rows[-1]['id']})")
+    except Exception:
+        logger.error(f"Ingestion stopped after {processed} chunks; "
+                     f"rerun with resume_from={processed} to continue")
+        raise
+    return inserted
+
+
+def _delete_trailing_sections(milvus_client, collection_name, section_counts):
+    """
+    删除来源中段落序号不小于新块数量的旧块：upgrade 模式按 来源+段落序号 覆盖写入，
+    文档变短后多出的旧段落不会被覆盖
+
+    Returns:
+        int: 删除的块数量
+    """
+    deleted = 0
+    for source, count in section_counts.items():
+        res = milvus_client.delete(
+            collection_name=collection_name,
+            filter=f"source == {_quote(_truncate_utf8(source, MAX_SOURCE_LENGTH))} and section >= {count}",
+        )
+        deleted += res.get("delete_count", 0) if isinstance(res, dict) else 0
+    return deleted
+
+
+def _keyed_by_occurrence(items, hash_of):
+    """以 (内容哈希, 该哈希在来源内第几次出现) 作为块的身份，允许同一来源中存在重复内容"""
+    keyed = {}
+    occurrences = {}
+    for item in items:
+        chunk_hash = hash_of(item)
+        occurrence = occurrences.get(chunk_hash, 0)
+        occurrences[chunk_hash] = occurrence + 1
+        keyed[(chunk_hash, occurrence)] = item
+    return keyed
+
+
+def _sync_source(milvus_client, collection_name, source, records, openai_client, embedding_model,
+                 insert_batch_size):
+    """
+    增量同步单个来源：只为新增/变化的块生成嵌入，未变化但段落序号移动的块复用已存储的向量更新元数据，
+    最后删除已消失的块
+
+    Returns:
+        dict: 新增、删除、移动和未变化的块数量
+    """
+    stored_rows = _query_all(milvus_client, collection_name,
+                             filter=f"source == {_quote(source)}",
+                             output_fields=["id", "section", "chunk_hash"])
+    stored_rows.sort(key=lambda row: row.get("section", 0))
+    existing = _keyed_by_occurrence(stored_rows, lambda row: row.get("chunk_hash"))
+    desired = _keyed_by_occurrence(records, lambda record: _chunk_hash(record["text"]))
+
+    stale_ids = [row["id"] for key, row in existing.items() if key not in desired]
+    new_keys = [key for key in desired if key not in existing]
+    moved_keys = [key for key, record in desired.items()
+                  if key in existing and existing[key].get("section") != record["section"]]
+
+    for batch_keys in _batched(new_keys, insert_batch_size):
+        vectors = embed_in_batches(openai_client, [desired[key]["text"] for key in batch_keys], embedding_model)
+        rows = [_to_row(desired[key], _chunk_id(source, *key), vector)
+                for key, vector in zip(batch_keys, vectors)]
+        milvus_client.upsert(collection_name=collection_name, data=rows)
+
+    for batch_keys in _batched(moved_keys, insert_batch_size):
+        ids_to_keys = {existing[key]["id"]: key for key in batch_keys}
+        stored = milvus_client.get(collection_name=collection_name, ids=list(ids_to_keys),
+                                   output_fields=["vector"])
+        rows = [_to_row(desired[ids_to_keys[row["id"]]], row["id"], row["vector"]) for row in stored]
+        milvus_client.upsert(collection_name=collection_name, data=rows)
+
+    # 新内容全部写入后才删除旧块，嵌入或写入中途失败时来源仍保留旧版本
+    if stale_ids:
+        milvus_client.delete(collection_name=collection_name, ids=stale_ids)
+
+    stats = {
+        "added": len(new_keys),
+        "deleted": len(stale_ids),
+        "moved": len(moved_keys),
+        "unchanged": len(desired) - len(new_keys) - len(moved_keys),
+    }
+    logger.info(f"Synced source {source}: {stats}")
+    return stats
+
+
 def update_rag_collection(mode, doc_path, milvus_client, openai_client, collection_name,
-                         embedding_dim, embedding_model):
+                         embedding_dim, embedding_model, insert_batch_size=None, resume_from=0,
+                         source=None):
     """
     更新RAG向量库
     
     Args:
-        mode: 操作模式 ('create' 或 'upgrade')
-        doc_path: 文档路径
+        mode: 操作模式 ('create'、'upgrade' 或 'sync')
+        doc_path: 文档路径或glob模式（支持 md、txt、pdf、docx）
         milvus_client: Milvus客户端实例
         openai_client: OpenAI客户端实例
         collection_name: 集合名称
         embedding_dim: 嵌入维度
         embedding_model: 嵌入模型
-        logger: 日志记录器（可选）
+        insert_batch_size: 每批嵌入并写入的块数量，默认读取 INSERT_BATCH_SIZE
+        resume_from: 从第几个块继续（用于中断后续传，create 模式下不会再删除集合）
+        source: 文档来源名称，默认使用文件路径；sync 模式以它识别同一文档的不同版本。
+            只能用于单个文件，与glob模式同时使用时每个文件都会被当作同一文档的新版本
     
     Returns:
         dict: 包含操作结果的字典
+    
+    Raises:
+        ValueError: 模式未知、集合不存在（upgrade 模式，或 create 模式续传时），或 source 与glob模式同时使用
     """
+    if source and glob.has_magic(doc_path):
+        raise ValueError(f"source cannot be combined with a glob doc_path: {doc_path}")
     
-    result = {"status": "success", "message": "", "flush_time": 0}
+    result = {"status": "success", "message": "", "flush_time": 0, "inserted": 0, "failed": []}
+    insert_batch_size = max(1, insert_batch_size or DEFAULT_INSERT_BATCH_SIZE)
     
     try:
         if mode == "create":
-            cooked_data = []
-            
-            # 读取文档
-            raw_text_lines = read_markdown(doc_path)
-            
-            # 如果集合已存在则删除
-            if milvus_client.has_collection(collection_name):
-                milvus_client.drop_collection(collection_name)
-                logger.info(f"Dropped existing collection {collection_name}")
-                result["message"] += f"Dropped existing collection {collection_name}. "
-            
-            # 创建新集合
-            milvus_client.create_collection(
-                collection_name=collection_name,
-                dimension=embedding_dim,
-                metric_type="IP",
-                consistency_level="Bounded",
-            )
-            
-            logger.info(f"Created collection {collection_name}")
-            result["message"] += f"Created collection {collection_name}. "
-            
-            # 生成嵌入并插入数据
-            for i, line in enumerate(tqdm(raw_text_lines, desc="Creating embeddings")):
-                cooked_data.append({
-                    "id": i, 
-                    "vector": embed_text(openai_client, line, embedding_model), 
-                    "text": line
-                })
+            if resume_from and milvus_client.has_collection(collection_name):
+                logger.info(f"Resuming creation of {collection_name} from chunk {resume_from}")
+                result["message"] += f"Resumed collection {collection_name} from chunk {resume_from}. "
+            elif resume_from:
+                # 集合不存在时续传会跳过前面的块，得到一个缺少内容的新集合
+                raise ValueError(f"Collection {collection_name} does not exist, cannot resume from chunk {resume_from}")
+            else:
+                # 如果集合已存在则删除
+                if milvus_client.has_collection(collection_name):
+                    milvus_client.drop_collection(collection_name)
+                    logger.info(f"Dropped existing collection {collection_name}")
+                    result["message"] += f"Dropped existing collection {collection_name}. "
+                
+                # 创建新集合
+                _create_qa_collection(milvus_client, collection_name, embedding_dim)
+                
+                logger.info(f"Created collection {collection_name}")
+                result["message"] += f"Created collection {collection_name}. "
             
-            milvus_client.insert(collection_name=collection_name, data=cooked_data)
-            result["message"] += f"Inserted {len(cooked_data)} documents."
+            # 流式读取文档、生成嵌入并分批写入
+            inserted = _insert_streaming(milvus_client, collection_name, _iter_chunk_records(doc_path, source, result["failed"]),
+                                         openai_client, embedding_model, start_id=0,
+                                         insert_batch_size=insert_batch_size, resume_from=resume_from)
+            result["inserted"] = inserted
+            result["message"] += f"Inserted {inserted} documents."
             
         elif mode == "upgrade":
             if milvus_client.has_collection(collection_name):
-                cooked_data = []
-                
-                # 读取文档
-                raw_text_lines = read_markdown(doc_path)
-                
-                # 获取当前最大ID
-                max_id = 0
-                try:
-                    # 尝试获取现有文档的最大ID
-                    query_res = milvus_client.query(
-                        collection_name=collection_name,
-                        filter="",
-                        output_fields=["id"],
-                        limit=1,
-                        offset=0,
-                        consistency_level="Strong"
-                    )
-                    if query_res:
-                        max_id = max([res["id"] for res in query_res])
-                except Exception as e:
-                    log(f"Failed to get max ID, starting from 0: {str(e)}")
-                
-                # 生成嵌入并插入新数据
-                for i, line in enumerate(tqdm(raw_text_lines, desc="Creating embeddings")):
-                    cooked_data.append({
-                        "id": max_id + i + 1,  # 避免ID冲突
-                        "vector": embed_text(openai_client, line, embedding_model), 
-                        "text": line
-                    })
-                
-                milvus_client.insert(collection_name=collection_name, data=cooked_data)
-                result["message"] += f"Appended {len(cooked_data)} documents."
+                # 流式读取文档、生成嵌入并分批追加；主键由 来源+段落序号 派生，
+                # 不依赖集合当前的最大ID，续传时与中断前写入的块ID一致
+                section_counts = {}
+                records = _iter_chunk_records(doc_path, source, result["failed"], section_counts)
+                inserted = _insert_streaming(milvus_client, collection_name, records,
+                                             openai_client, embedding_model, start_id=None,
+                                             insert_batch_size=insert_batch_size, resume_from=resume_from)
+                # 全部写入后再删除文档变短后多出的旧段落
+                deleted = _delete_trailing_sections(milvus_client, collection_name, section_counts)
+                result["inserted"] = inserted
+                result["deleted"] = deleted
+                result["message"] += f"Appended {inserted} documents, removed {deleted} trailing sections."
             else:
                 raise ValueError(f"Collection {collection_name} does not exist")
+        elif mode == "sync":
+            if not milvus_client.has_collection(collection_name):
+                _create_qa_collection(milvus_client, collection_name, embedding_dim)
+                logger.info(f"Created collection {collection_name}")
+                result["message"] += f"Created collection {collection_name}. "
+            
+            # 按来源逐个文档比对内容哈希，只处理差异部分
+            totals = {"added": 0, "deleted": 0, "moved": 0, "unchanged": 0}
+            # 解析失败的文件不会产出，其已有内容保持不变
+            for file_path, chunks in iter_document_files(doc_path, failures=result["failed"]):
+                records = [{"source": source or file_path, "section": section, "heading": chunk["heading"],
+                            "text": chunk["text"]}
+                           for section, chunk in enumerate(chunks)]
+                stats = _sync_source(milvus_client, collection_name, source or file_path, records,
+                                     openai_client, embedding_model, insert_batch_size)
+                for key, value in stats.items():
+                    totals[key] += value
+            result["inserted"] = totals["added"]
+            result["sync"] = totals
+            result["message"] += (f"Synced documents: {totals['added']} added, {totals['deleted']} deleted, "
+                                  f"{totals['moved']} moved, {totals['unchanged']} unchanged.")
         else:
             raise ValueError(f"Unknown collection update mode: {mode}")
+        if result["failed"]:
+            result["message"] += f" Skipped {len(result['failed'])} unreadable documents."
         
         # 刷新数据
         logger.info("Start to flush")
@@ -123,6 +410,13 @@ def update_rag_collection(mode, doc_path, milvus_client, openai_client, collecti
     except Exception as e:
         logger.error(f"Error during update: {str(e)}")
         raise
+    finally:
+        # 集合可能被重建，元数据缓存需要重新读取
+        collection_cache.invalidate(collection_name)
+        # 集合内容可能已变化（包括部分写入），旧的缓存回答不再可信
+        answer_cache = get_answer_cache()
+        if answer_cache is not None:
+            answer_cache.invalidate(collection_name)
 
 
 # 以下为直接运行此脚本时的示例代码
@@ -149,7 +443,7 @@ if __name__ == "__main__":
     
     # 执行更新
     result = update_rag_collection(
-        mode="create",
+        mode=os.environ.get("RAG_UPDATE_MODE", "create"),
         doc_path=doc_path,
         milvus_client=milvus_client,
         openai_client=openai_client,
@@ -0,0 +1,190 @@
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from pymilvus import MilvusClient
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.env_utils import load_env_config
+from utils.index_config import INDEX_DEFAULTS, TUNABLE_SEARCH_PARAMS, add_vector_index
+from utils.logger_util import setup_logging
+
+# 设置日志器
+logger = setup_logging('utils.benchmark_index')
+
+# 未指定 --values 时每种检索参数扫描的取值
+DEFAULT_SWEEPS = {
+    "ef": [16, 32, 64, 128, 256, 512],
+    "nprobe": [1, 4, 8, 16, 32, 64, 128],
+    "search_list": [20, 50, 100, 200, 400],
+    "level": [1, 2, 3, 4, 5],
+}
+
+
+def iter_vectors(milvus_client, collection_name, id_field, vector_field, batch_size=1000):
+    """用查询迭代器分批取回集合中的 (主键, 向量矩阵)"""
+    iterator = milvus_client.query_iterator(
+        collection_name=collection_name,
+        batch_size=batch_size,
+        filter="",
+        output_fields=[id_field, vector_field],
+    )
+    try:
+        while True:
+            batch = iterator.next()
+            if not batch:
+                break
+            ids = np.array([row[id_field] for row in batch])
+            vectors = np.asarray([row[vector_field] for row in batch], dtype=np.float32)
+            yield ids, vectors
+    finally:
+        iterator.close()
+
+
+def _scores(queries, vectors, metric_type):
+    """按度量计算相似度得分，得分越大越相似"""
+    if metric_type == "L2":
+        return -(np.sum(queries ** 2, axis=1, keepdims=True) - 2 * queries @ vectors.T
+                 + np.sum(vectors ** 2, axis=1))
+    if metric_type == "COSINE":
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    return queries @ vectors.T
+
+
+def sample_queries(milvus_client, collection_name, id_field, vector_field, num_queries, seed=0):
+    """从集合中均匀抽样查询向量（蓄水池抽样，只遍历一次集合）"""
+    rng = np.random.default_rng(seed)
+    reservoir = []
+    seen = 0
+    for _, vectors in iter_vectors(milvus_client, collection_name, id_field, vector_field):
+        for vector in vectors:
+            if len(reservoir) < num_queries:
+                reservoir.append(vector)
+            else:
+                j = rng.integers(0, seen + 1)
+                if j < num_queries:
+                    reservoir[j] = vector
+            seen += 1
+    return np.stack(reservoir), seen
+
+
+def brute_force_top_k(milvus_client, collection_name, id_field, vector_field, queries, top_k, metric_type):
+    """
+    流式遍历整个集合精确计算每个查询的 top_k 主键，作为召回率的基准
+
+    Returns:
+        list: 每个查询的 top_k 主键集合，集合中向量不足 top_k 个时为全部主键
+    """
+    best_scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+    best_ids = np.zeros((len(queries), top_k), dtype=np.int64)
+    for ids, vectors in iter_vectors(milvus_client, collection_name, id_field, vector_field):
+        scores = np.concatenate([best_scores, _scores(queries, vectors, metric_type)], axis=1)
+        candidates = np.concatenate([best_ids, np.broadcast_to(ids, (len(queries), len(ids)))], axis=1)
+        keep = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        best_scores = np.take_along_axis(scores, keep, axis=1)
+        best_ids = np.take_along_axis(candidates, keep, axis=1)
+    # 集合中向量少于 top_k 时，未被填充的位置仍是初始的 -inf 和占位ID 0，不能算进基准
+    return [set(ids[~np.isneginf(scores)].tolist()) for ids, scores in zip(best_ids, best_scores)]
+
+
+def measure(milvus_client, collection_name, vector_field, queries, ground_truth, top_k, search_params):
+    """逐条发送查询，返回 recall@top_k 与单次查询延迟的 p50/p95/p99（毫秒）"""
+    latencies = []
+    recalls = []
+    for query, expected in zip(queries, ground_truth):
+        start = time.perf_counter()
+        result = milvus_client.search(
+            collection_name,
+            data=[query.tolist()],
+            anns_field=vector_field,
+            limit=top_k,
+            search_params=search_params,
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        found = {hit["id"] for hit in result[0]}
+        if expected:
+            recalls.append(len(found & expected) / len(expected))
+    return {
+        "recall": float(np.mean(recalls)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+def rebuild_index(milvus_client, collection_name, vector_field, index_type, metric_type, index_params):
+    """释放集合并按给定参数重建向量索引，用于比较不同索引类型"""
+    logger.info(f"Rebuilding {vector_field} index of {collection_name} as {index_type} {index_params}")
+    milvus_client.release_collection(collection_name)
+    for index_name in milvus_client.list_indexes(collection_name, field_name=vector_field):
+        milvus_client.drop_index(collection_name, index_name)
+    index_config = {"index_type": index_type, "metric_type": metric_type, "index_params": index_params}
+    milvus_client.create_index(collection_name,
+                               add_vector_index(milvus_client.prepare_index_params(), vector_field, index_config))
+    milvus_client.load_collection(collection_name)
+
+
+def describe_vector_index(milvus_client, collection_name, vector_field):
+    for index_name in milvus_client.list_indexes(collection_name, field_name=vector_field):
+        return milvus_client.describe_index(collection_name, index_name)
+    raise ValueError(f"Collection {collection_name} has no index on field {vector_field}")
+
+
+def main():
+    load_env_config("../.env")
+
+    parser = argparse.ArgumentParser(
+        description="Sweep ANN search params on a Milvus collection and report recall@k against brute force")
+    parser.add_argument("--collection", default=os.environ.get("QA_COLLECTION_NAME", "default_collection"))
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--vector-field", default="vector")
+    parser.add_argument("--queries", type=int, default=100, help="number of query vectors sampled from the collection")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--param", help="search param to sweep, defaults to the tunable param of the index type")
+    parser.add_argument("--values", type=int, nargs="+", help="values of --param to sweep")
+    parser.add_argument("--rebuild-index", choices=list(INDEX_DEFAULTS),
+                        help="drop and rebuild the vector index with this type before measuring")
+    parser.add_argument("--index-params", default="{}", help="JSON build params used with --rebuild-index")
+    args = parser.parse_args()
+
+    milvus_client = MilvusClient(uri=os.environ.get("MILVUS_URI", "http://localhost:19530"),
+                                 token=os.environ.get("MILVUS_TOKEN", ""))
+
+    index = describe_vector_index(milvus_client, args.collection, args.vector_field)
+    metric_type = index["metric_type"]
+    if args.rebuild_index:
+        index_params = {**INDEX_DEFAULTS[args.rebuild_index][0], **json.loads(args.index_params)}
+        rebuild_index(milvus_client, args.collection, args.vector_field, args.rebuild_index, metric_type, index_params)
+        index = describe_vector_index(milvus_client, args.collection, args.vector_field)
+    index_type = index["index_type"]
+    logger.info(f"Collection {args.collection}: {index_type} index, metric {metric_type}, params {index}")
+
+    queries, total = sample_queries(milvus_client, args.collection, args.id_field, args.vector_field, args.queries)
+    logger.info(f"Sampled {len(queries)} queries from {total} vectors, computing exact top-{args.top_k}")
+    start = time.perf_counter()
+    ground_truth = brute_force_top_k(milvus_client, args.collection, args.id_field, args.vector_field,
+                                     queries, args.top_k, metric_type)
+    logger.info(f"Brute force finished in {time.perf_counter() - start:.1f}s")
+
+    tunable = TUNABLE_SEARCH_PARAMS.get(index_type, ())
+    param = args.param or (tunable[0] if tunable else None)
+    values = args.values or DEFAULT_SWEEPS.get(param, [])
+    sweep = [(param, value) for value in values] if param else [(None, None)]
+
+    logger.info(f"{'param':<16}{'recall@' + str(args.top_k):>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, value in sweep:
+        params = {name: value} if name else {}
+        stats = measure(milvus_client, args.collection, args.vector_field, queries, ground_truth, args.top_k,
+                        {"metric_type": metric_type, "params": params})
+        label = f"{name}={value}" if name else "default"
+        logger.info(f"{label:<16}{stats['recall']:>12.4f}{stats['p50_ms']:>10.2f}"
+                    f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.logger_util import setup_logging
+
+# 在模块加载时设置默认日志器
+logger = setup_logging('collection.cache')
+
+
+class CollectionMetadataCache:
+    """
+    集合元数据缓存：缓存集合是否存在、schema、向量维度、索引类型和加载状态，避免每个请求都访问Milvus
+
+    集合被本进程修改时调用 invalidate；其他进程（如图像索引脚本）的修改在 ttl 秒后生效。
+
+    Args:
+        ttl: 缓存有效期（秒）
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, name, key):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry and key in entry and time.time() - entry[key][1] < self.ttl:
+                self.hits += 1
+                return True, entry[key][0]
+            self.misses += 1
+            return False, None
+
+    def _set(self, name, key, value):
+        with self._lock:
+            self._entries.setdefault(name, {})[key] = (value, time.time())
+        return value
+
+    def has_collection(self, milvus_client, name):
+        found, value = self._get(name, "exists")
+        if found:
+            return value
+        return self._set(name, "exists", milvus_client.has_collection(name))
+
+    async def async_has_collection(self, async_milvus_client, name):
+        """has_collection 的异步版本，与同步版本共享缓存"""
+        found, value = self._get(name, "exists")
+        if found:
+            return value
+        return self._set(name, "exists", await async_milvus_client.has_collection(name))
+
+    def describe(self, milvus_client, name):
+        """
+        获取集合schema摘要
+
+        Returns:
+            dict: {"fields": [...], "dimension": 向量维度或None}
+        """
+        found, value = self._get(name, "schema")
+        if found:
+            return value
+        return self._set(name, "schema", self._summarize(milvus_client.describe_collection(name)))
+
+    async def async_describe(self, async_milvus_client, name):
+        """describe 的异步版本，与同步版本共享缓存"""
+        found, value = self._get(name, "schema")
+        if found:
+            return value
+        return self._set(name, "schema", self._summarize(await async_milvus_client.describe_collection(name)))
+
+    @staticmethod
+    def _summarize(description):
+        dimension = None
+        for field in description.get("fields", []):
+            dim = field.get("params", {}).get("dim")
+            if dim is not None:
+                dimension = int(dim)
+                break
+        return {"fields": description.get("fields", []), "dimension": dimension}
+
+    @staticmethod
+    def has_field(schema, field_name):
+        """判断 describe 返回的schema摘要中是否包含某个字段"""
+        return any(field.get("name") == field_name for field in schema["fields"])
+
+    def index_type(self, milvus_client, name, field_name="vector"):
+        """
+        获取集合上实际构建的向量索引类型，与环境变量中的配置无关
+
+        Returns:
+            str: 如 HNSW、IVF_FLAT；集合或索引不存在时返回None（不缓存）
+        """
+        key = f"index_type:{field_name}"
+        found, value = self._get(name, key)
+        if found:
+            return value
+        try:
+            description = milvus_client.describe_index(name, field_name)
+        except Exception as e:
+            logger.warning(f"Failed to describe index {field_name} of {name}: {str(e)}")
+            return None
+        return self._set(name, key, self._index_type_of(description))
+
+    async def async_index_type(self, async_milvus_client, name, field_name="vector"):
+        """index_type 的异步版本，与同步版本共享缓存"""
+        key = f"index_type:{field_name}"
+        found, value = self._get(name, key)
+        if found:
+            return value
+        try:
+            description = await async_milvus_client.describe_index(name, field_name)
+        except Exception as e:
+            logger.warning(f"Failed to describe index {field_name} of {name}: {str(e)}")
+            return None
+        return self._set(name, key, self._index_type_of(description))
+
+    @staticmethod
+    def _index_type_of(description):
+        index_type = (description or {}).get("index_type")
+        return index_type.upper() if index_type else None
+
+    def load_state(self, milvus_client, name):
+        found, value = self._get(name, "load_state")
+        if found:
+            return value
+        state = milvus_client.get_load_state(name).get("state")
+        # LoadState 枚举：NotExist / NotLoad / Loading / Loaded
+        return self._set(name, "load_state", getattr(state, "name", str(state)))
+
+    def ensure_loaded(self, milvus_client, name):
+        """集合存在但未加载时加载到内存，避免首个检索请求承担加载耗时"""
+        if not self.has_collection(milvus_client, name):
+            logger.info(f"Collection {name} does not exist, skip loading")
+            return False
+        if self.load_state(milvus_client, name) != "Loaded":
+            logger.info(f"Loading collection {name}")
+            milvus_client.load_collection(name)
+            self.invalidate(name)
+        logger.info(f"Collection {name} is loaded (dimension: {self.describe(milvus_client, name)['dimension']})")
+        return True
+
+    def invalidate(self, name=None):
+        """清空指定集合（或全部）的缓存，集合被创建、删除或修改后调用"""
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "collections": sorted(self._entries),
+                "ttl": self.ttl,
+            }
+
+
+# 进程内共享的集合元数据缓存
+collection_cache = CollectionMetadataCache(ttl=float(os.environ.get("COLLECTION_CACHE_TTL", "60")))
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.logger_util import setup_logging
+
+# 在模块加载时设置默认日志器
+logger = setup_logging('embedding.cache')
+
+
+def cache_key(model, text):
+    """以 模型名称 + 文本摘要 作为缓存键"""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    两级嵌入向量缓存：进程内LRU + SQLite磁盘存储（float32）
+
+    Args:
+        path: SQLite文件路径，为空时只使用内存缓存
+        lru_size: 内存LRU最多保留的向量数量
+        max_items: 磁盘上最多保留的向量数量，超出后按最近访问时间淘汰到上限的90%
+    """
+
+    def __init__(self, path=None, lru_size=1024, max_items=100000):
+        self.path = path
+        self.lru_size = lru_size
+        self.max_items = max_items
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # 磁盘条目数的上界估计：写入时累加（覆盖写入也计入），超过上限时才执行 COUNT(*) 校准
+        self._disk_estimate = 0
+
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+            self._conn.commit()
+            self._disk_estimate = self._disk_size()
+            logger.info(f"Opened embedding cache at {path} ({self._disk_estimate} vectors)")
+
+    def _disk_size(self):
+        return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _remember(self, key, vector):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def get_many(self, model, texts):
+        """
+        批量查询缓存
+
+        Returns:
+            list: 与输入顺序一致，未命中的位置为None
+        """
+        keys = [cache_key(model, text) for text in texts]
+        results = [None] * len(keys)
+        with self._lock:
+            missing = {}
+            for i, key in enumerate(keys):
+                vector = self._lru.get(key)
+                if vector is not None:
+                    self._lru.move_to_end(key)
+                    results[i] = vector
+                    self.memory_hits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+
+            if missing and self._conn is not None:
+                found = {}
+                key_list = list(missing)
+                # SQLite 单条语句的参数数量有限，分段查询
+                for start in range(0, len(key_list), 500):
+                    part = key_list[start:start + 500]
+                    placeholders = ",".join("?" * len(part))
+                    for key, blob in self._conn.execute(
+                            f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", part):
+                        found[key] = array("f", blob).tolist()
+                if found:
+                    now = time.time()
+                    self._conn.executemany("UPDATE embeddings SET last_access = ? WHERE key = ?",
+                                           [(now, key) for key in found])
+                    self._conn.commit()
+                for key, vector in found.items():
+                    self._remember(key, vector)
+                    for i in missing.pop(key):
+                        results[i] = vector
+                        self.disk_hits += 1
+
+            self.misses += sum(len(positions) for positions in missing.values())
+        return results
+
+    def put_many(self, model, texts, vectors):
+        """批量写入缓存，磁盘条目超过上限时淘汰最久未访问的向量"""
+        rows = []
+        with self._lock:
+            now = time.time()
+            for text, vector in zip(texts, vectors):
+                key = cache_key(model, text)
+                self._remember(key, vector)
+                rows.append((key, model, array("f", vector).tobytes(), now))
+            if self._conn is None or not rows:
+                return
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_access) VALUES (?, ?, ?, ?)", rows)
+            # 估计值未超过上限时不统计全表，避免每次写入都做 O(n) 的 COUNT(*)
+            self._disk_estimate += len(rows)
+            if self._disk_estimate > self.max_items:
+                size = self._disk_size()
+                # 淘汰到上限的90%，留出余量，避免达到上限后每次写入都重新统计
+                excess = size - self.max_items * 9 // 10 if size > self.max_items else 0
+                if excess > 0:
+                    self._conn.execute(
+                        "DELETE FROM embeddings WHERE key IN "
+                        "(SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)", (excess,))
+                    self.evictions += excess
+                self._disk_estimate = size - excess
+            self._conn.commit()
+
+    def stats(self):
+        """返回命中/未命中计数和缓存大小"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "memory_items": len(self._lru),
+                "disk_items": self._disk_size() if self._conn is not None else 0,
+                "path": self.path,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
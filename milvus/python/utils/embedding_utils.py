@@ -1,31 +1,324 @@
+import asyncio
+import atexit
 import os
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import httpx
+from tqdm import tqdm
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.logger_util import setup_logging
 from utils.env_utils import load_env_config
+from utils.embedding_cache import EmbeddingCache
 
 
 logger = setup_logging('embedding.util')
 
 load_env_config("../.env")
 
-def embed_text(openai_client, text, model):
-    if os.environ.get("EMBEDDING_MODEL").startswith("customize"):
-        logger.info(f"going to use embedding model: {os.environ.get('EMBEDDING_MODEL')} with base url: {os.environ.get('EMBEDDING_BASE_URL')}")
-        http_client = httpx.Client(base_url=os.environ.get("EMBEDDING_BASE_URL"))
-        return (
-            http_client.post("/embed", json={
-                "texts": [text],
-                "batch_size": 64
-            })
-            .json()["embeddings"][0]
+# 批量嵌入的默认参数（DashScope text-embedding-v4 单次最多接受10条文本）
+DEFAULT_EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "10"))
+DEFAULT_EMBEDDING_CONCURRENCY = int(os.environ.get("EMBEDDING_CONCURRENCY", "4"))
+
+
+def _use_custom_backend():
+    return os.environ.get("EMBEDDING_MODEL", "").startswith("customize")
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class _BaseEmbeddingClient:
+    """
+    自定义嵌入服务(/embed)HTTP客户端的公共部分：连接池、HTTP/2 配置；同步与异步客户端各自实现请求和关闭
+    
+    Args:
+        base_url: 嵌入服务地址，默认读取 EMBEDDING_BASE_URL
+        max_connections: 连接池最大连接数，默认读取 EMBEDDING_MAX_CONNECTIONS
+        max_keepalive_connections: 最大空闲keep-alive连接数，默认读取 EMBEDDING_MAX_KEEPALIVE
+        keepalive_expiry: 空闲连接保留秒数，默认读取 EMBEDDING_KEEPALIVE_EXPIRY
+        timeout: 请求超时秒数，默认读取 EMBEDDING_TIMEOUT
+        http2: 是否启用HTTP/2，默认读取 EMBEDDING_HTTP2
+    """
+
+    _client_class = None
+
+    def __init__(self, base_url=None, max_connections=None, max_keepalive_connections=None,
+                 keepalive_expiry=None, timeout=None, http2=None):
+        self.base_url = base_url or os.environ.get("EMBEDDING_BASE_URL", "")
+        limits = httpx.Limits(
+            max_connections=max_connections or int(os.environ.get("EMBEDDING_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=max_keepalive_connections or int(os.environ.get("EMBEDDING_MAX_KEEPALIVE", "10")),
+            keepalive_expiry=keepalive_expiry or float(os.environ.get("EMBEDDING_KEEPALIVE_EXPIRY", "30")),
         )
+        timeout = timeout or float(os.environ.get("EMBEDDING_TIMEOUT", "30"))
+        if http2 is None:
+            http2 = os.environ.get("EMBEDDING_HTTP2", "true").lower() == "true"
+        if http2 and not _http2_available():
+            logger.info("h2 package is not installed, falling back to HTTP/1.1 for embedding client")
+            http2 = False
+        self.http2 = http2
+        self._client = self._client_class(base_url=self.base_url, limits=limits,
+                                          timeout=httpx.Timeout(timeout), http2=http2)
+        logger.info(f"Created embedding client for {self.base_url} (http2={http2}, {limits})")
+
+    @property
+    def closed(self):
+        return self._client.is_closed
+
+
+class EmbeddingClient(_BaseEmbeddingClient):
+    """自定义嵌入服务(/embed)的HTTP客户端，复用keep-alive连接池，在安装了h2时启用HTTP/2，参数见 _BaseEmbeddingClient"""
+
+    _client_class = httpx.Client
+
+    def embed(self, texts, batch_size=None):
+        """
+        调用 /embed 接口生成嵌入向量
+        
+        Args:
+            texts: 文本列表
+            batch_size: 服务端批大小，默认与文本数量一致
+        
+        Returns:
+            list: 与输入顺序一致的向量列表
+        """
+        texts = list(texts)
+        response = self._client.post("/embed", json={
+            "texts": texts,
+            "batch_size": batch_size or len(texts)
+        })
+        response.raise_for_status()
+        return response.json()["embeddings"]
+
+    def close(self):
+        if not self._client.is_closed:
+            self._client.close()
+            logger.info(f"Closed embedding client for {self.base_url}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AsyncEmbeddingClient(_BaseEmbeddingClient):
+    """EmbeddingClient 的异步版本，供ASGI服务在事件循环中使用，参数与 EmbeddingClient 相同，只支持 async with"""
+
+    _client_class = httpx.AsyncClient
+
+    async def embed(self, texts, batch_size=None):
+        texts = list(texts)
+        response = await self._client.post("/embed", json={
+            "texts": texts,
+            "batch_size": batch_size or len(texts)
+        })
+        response.raise_for_status()
+        return response.json()["embeddings"]
+
+    async def aclose(self):
+        if not self._client.is_closed:
+            await self._client.aclose()
+            logger.info(f"Closed async embedding client for {self.base_url}")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+
+# 进程内共享的嵌入客户端，供 answer_question、update_rag_collection 和 Flask 应用复用
+_embedding_client = None
+_embedding_client_lock = threading.Lock()
+
+
+def get_embedding_client():
+    """获取（必要时创建）进程内共享的嵌入客户端"""
+    global _embedding_client
+    if _embedding_client is None or _embedding_client.closed:
+        with _embedding_client_lock:
+            if _embedding_client is None or _embedding_client.closed:
+                _embedding_client = EmbeddingClient()
+    return _embedding_client
+
+
+def close_embedding_client():
+    """关闭共享的嵌入客户端，释放连接池"""
+    global _embedding_client
+    with _embedding_client_lock:
+        if _embedding_client is not None:
+            _embedding_client.close()
+            _embedding_client = None
+
+
+atexit.register(close_embedding_client)
+
+
+# 进程内共享的嵌入缓存，EMBEDDING_CACHE_ENABLED=false 时关闭
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """获取（必要时创建）进程内共享的嵌入缓存，未启用时返回None"""
+    global _embedding_cache
+    if os.environ.get("EMBEDDING_CACHE_ENABLED", "true").lower() != "true":
+        return None
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                _embedding_cache = EmbeddingCache(
+                    path=os.environ.get("EMBEDDING_CACHE_PATH", os.path.join("uploads", "embedding_cache.sqlite3")),
+                    lru_size=int(os.environ.get("EMBEDDING_CACHE_LRU_SIZE", "1024")),
+                    max_items=int(os.environ.get("EMBEDDING_CACHE_MAX_ITEMS", "100000")),
+                )
+    return _embedding_cache
+
+
+def _cache_model_name(model):
+    # customize 后端忽略 model 参数，以实际的 EMBEDDING_MODEL 区分缓存
+    return os.environ.get("EMBEDDING_MODEL", "") if _use_custom_backend() else model
+
+
+def embed_text(openai_client, text, model):
+    cache = get_embedding_cache()
+    if cache is not None:
+        cached = cache.get_many(_cache_model_name(model), [text])[0]
+        if cached is not None:
+            return cached
+    vector = _embed_text_remote(openai_client, text, model)
+    if cache is not None:
+        cache.put_many(_cache_model_name(model), [text], [vector])
+    return vector
+
+
+async def async_embed_text(async_openai_client, text, model, embedding_client=None):
+    """
+    embed_text 的异步版本
+
+    Args:
+        async_openai_client: AsyncOpenAI客户端实例
+        text: 文本
+        model: 嵌入模型名称
+        embedding_client: customize 后端使用的 AsyncEmbeddingClient
+    """
+    cache = get_embedding_cache()
+    # 缓存读写SQLite，放到线程中执行，避免阻塞事件循环
+    if cache is not None:
+        cached = (await asyncio.to_thread(cache.get_many, _cache_model_name(model), [text]))[0]
+        if cached is not None:
+            return cached
+    if _use_custom_backend():
+        if embedding_client is None:
+            raise ValueError("An AsyncEmbeddingClient is required for the customize embedding backend")
+        vector = (await embedding_client.embed([text], batch_size=64))[0]
+    else:
+        response = await async_openai_client.embeddings.create(input=text, model=model)
+        vector = response.data[0].embedding
+    if cache is not None:
+        await asyncio.to_thread(cache.put_many, _cache_model_name(model), [text], [vector])
+    return vector
+
+
+def _embed_text_remote(openai_client, text, model):
+    if _use_custom_backend():
+        logger.debug(f"going to use embedding model: {os.environ.get('EMBEDDING_MODEL')} with base url: {os.environ.get('EMBEDDING_BASE_URL')}")
+        return get_embedding_client().embed([text], batch_size=64)[0]
     else:
-        logger.info(f"going to use embedding openai model: {model} with base url: {os.environ.get('EMBEDDING_BASE_URL')}")
+        logger.debug(f"going to use embedding openai model: {model} with base url: {os.environ.get('EMBEDDING_BASE_URL')}")
         return (
             openai_client.embeddings.create(input=text, model=model)
             .data[0]
             .embedding
     )
+
+
+def embed_texts(openai_client, texts, model):
+    """
+    一次请求生成一批文本的嵌入向量，已缓存的文本不再请求嵌入服务
+
+    Args:
+        openai_client: OpenAI客户端实例
+        texts: 文本列表
+        model: 嵌入模型名称
+
+    Returns:
+        list: 与输入顺序一致的向量列表
+    """
+    texts = list(texts)
+    cache = get_embedding_cache()
+    if cache is None:
+        return _embed_texts_remote(openai_client, texts, model)
+
+    vectors = cache.get_many(_cache_model_name(model), texts)
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        fresh = _embed_texts_remote(openai_client, [texts[i] for i in missing], model)
+        if len(fresh) != len(missing):
+            raise ValueError(f"Embedding backend returned {len(fresh)} vectors for {len(missing)} texts")
+        cache.put_many(_cache_model_name(model), [texts[i] for i in missing], fresh)
+        for i, vector in zip(missing, fresh):
+            vectors[i] = vector
+    return vectors
+
+
+def _embed_texts_remote(openai_client, texts, model):
+    if not texts:
+        return []
+    if _use_custom_backend():
+        return get_embedding_client().embed(texts)
+    else:
+        response = openai_client.embeddings.create(input=list(texts), model=model)
+        # 按返回的index排序，保证与输入顺序一致
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+def embed_in_batches(openai_client, texts, model, batch_size=None, max_workers=None, desc=None):
+    """
+    将文本按批次切分并发生成嵌入向量
+
+    Args:
+        openai_client: OpenAI客户端实例
+        texts: 文本列表
+        model: 嵌入模型名称
+        batch_size: 每批文本数量，默认读取 EMBEDDING_BATCH_SIZE
+        max_workers: 同时进行的批次数，默认读取 EMBEDDING_CONCURRENCY
+        desc: 进度条描述，为None时不显示进度条
+
+    Returns:
+        list: 与输入顺序一致的向量列表
+    """
+    texts = list(texts)
+    batch_size = max(1, batch_size or DEFAULT_EMBEDDING_BATCH_SIZE)
+    max_workers = max(1, max_workers or DEFAULT_EMBEDDING_CONCURRENCY)
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    logger.info(f"Embedding {len(texts)} texts in {len(batches)} batches "
+                f"(batch_size={batch_size}, concurrency={max_workers}) with model: {model}")
+
+    progress = tqdm(total=len(texts), desc=desc) if desc else None
+
+    def _embed_batch(batch):
+        vectors = embed_texts(openai_client, batch, model)
+        if len(vectors) != len(batch):
+            raise ValueError(f"Embedding backend returned {len(vectors)} vectors for {len(batch)} texts")
+        if progress is not None:
+            progress.update(len(batch))
+        return vectors
+
+    try:
+        # executor.map 按提交顺序返回结果，保证向量与文本一一对应
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_embed_batch, batches))
+    finally:
+        if progress is not None:
+            progress.close()
+
+    return [vector for batch_vectors in results for vector in batch_vectors]
@@ -0,0 +1,102 @@
+import json
+import os
+
+
+# 各索引类型的默认构建参数和检索参数，可通过 <PREFIX>_INDEX_PARAMS / <PREFIX>_SEARCH_PARAMS 覆盖
+INDEX_DEFAULTS = {
+    "AUTOINDEX": ({}, {}),
+    "FLAT": ({}, {}),
+    "HNSW": ({"M": 16, "efConstruction": 200}, {"ef": 64}),
+    "IVF_FLAT": ({"nlist": 1024}, {"nprobe": 16}),
+    "IVF_SQ8": ({"nlist": 1024}, {"nprobe": 16}),
+    "IVF_PQ": ({"nlist": 1024, "m": 16, "nbits": 8}, {"nprobe": 16}),
+    "DISKANN": ({}, {"search_list": 100}),
+}
+
+# 每种索引允许按请求调整的检索参数，对应召回率和延迟之间的取舍
+TUNABLE_SEARCH_PARAMS = {
+    "AUTOINDEX": ("level",),
+    "FLAT": (),
+    "HNSW": ("ef",),
+    "IVF_FLAT": ("nprobe",),
+    "IVF_SQ8": ("nprobe",),
+    "IVF_PQ": ("nprobe",),
+    "DISKANN": ("search_list",),
+}
+
+
+def _json_env(name):
+    value = os.environ.get(name, "").strip()
+    if not value:
+        return {}
+    params = json.loads(value)
+    if not isinstance(params, dict):
+        raise ValueError(f"{name} must be a JSON object, got: {value}")
+    return params
+
+
+def load_index_config(prefix, metric_type, index_type=None):
+    """
+    从环境变量读取集合的向量索引配置
+
+    Args:
+        prefix: 环境变量前缀，如 QA 或 IMAGE
+        metric_type: 集合使用的距离度量，由向量本身决定，不可配置
+        index_type: 集合上实际构建的索引类型（describe_index 的结果），检索时传入；
+            为空时使用 <PREFIX>_INDEX_TYPE，即建索引时的配置
+
+    Returns:
+        dict: {"index_type", "metric_type", "index_params", "search_params"}
+    """
+    configured_type = os.environ.get(f"{prefix}_INDEX_TYPE", "AUTOINDEX").upper()
+    if configured_type not in INDEX_DEFAULTS:
+        raise ValueError(f"Unsupported {prefix}_INDEX_TYPE: {configured_type}, expected one of {list(INDEX_DEFAULTS)}")
+    index_type = (index_type or configured_type).upper()
+    default_index_params, default_search_params = INDEX_DEFAULTS.get(index_type, ({}, {}))
+    # <PREFIX>_SEARCH_PARAMS 针对配置的索引类型，集合实际使用其他索引（如修改配置后未重建）时改用该索引的默认值
+    search_params = _json_env(f"{prefix}_SEARCH_PARAMS") if index_type == configured_type else {}
+    return {
+        "index_type": index_type,
+        "metric_type": metric_type,
+        "index_params": {**default_index_params, **_json_env(f"{prefix}_INDEX_PARAMS")},
+        "search_params": {**default_search_params, **search_params},
+    }
+
+
+def add_vector_index(index_params, field_name, index_config):
+    """按配置向 prepare_index_params() 的结果中添加向量索引"""
+    index_params.add_index(
+        field_name=field_name,
+        index_type=index_config["index_type"],
+        metric_type=index_config["metric_type"],
+        params=index_config["index_params"],
+    )
+    return index_params
+
+
+def build_search_params(index_config, overrides=None):
+    """
+    合并默认检索参数与单次请求的覆盖值
+
+    Args:
+        index_config: load_index_config 的返回值
+        overrides: 请求中传入的检索参数，如 {"ef": 128}
+
+    Returns:
+        dict: 可直接传给 search 的 search_params
+
+    Raises:
+        ValueError: 覆盖了当前索引类型不支持调整的参数，或参数值不是整数
+    """
+    params = dict(index_config["search_params"])
+    if overrides:
+        allowed = TUNABLE_SEARCH_PARAMS.get(index_config["index_type"], ())
+        unknown = sorted(set(overrides) - set(allowed))
+        if unknown:
+            raise ValueError(f"Unsupported search params {unknown} for index {index_config['index_type']}, "
+                             f"tunable params: {list(allowed)}")
+        try:
+            params.update({key: int(value) for key, value in overrides.items()})
+        except (TypeError, ValueError):
+            raise ValueError(f"Search params must be integers, got: {overrides}")
+    return {"metric_type": index_config["metric_type"], "params": params}
@@ -0,0 +1,135 @@
+import os
+import re
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.token_utils import count_tokens, split_sentences, split_tokens
+
+_HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_FENCE_PATTERN = re.compile(r"^\s*(```|~~~)")
+
+
+def _iter_blocks(text):
+    """
+    按行解析markdown，产出 (标题路径, 块文本, 是否代码块)
+
+    标题行只更新标题路径，不产出内容；代码块内的 # 不视为标题，整个代码块作为一个块
+    """
+    headings = []
+    paragraph = []
+    code = None
+    fence = None
+    for line in text.splitlines():
+        if code is not None:
+            code.append(line)
+            if line.strip().startswith(fence):
+                yield tuple(title for _, title in headings), "\n".join(code), True
+                code = None
+            continue
+        fence_match = _FENCE_PATTERN.match(line)
+        heading_match = None if fence_match else _HEADING_PATTERN.match(line)
+        if fence_match or heading_match or not line.strip():
+            if paragraph:
+                yield tuple(title for _, title in headings), "\n".join(paragraph), False
+                paragraph = []
+        if fence_match:
+            fence = fence_match.group(1)
+            code = [line]
+        elif heading_match:
+            level = len(heading_match.group(1))
+            headings = [(lvl, title) for lvl, title in headings if lvl < level] + [(level, heading_match.group(2))]
+        elif line.strip():
+            paragraph.append(line)
+    if paragraph:
+        yield tuple(title for _, title in headings), "\n".join(paragraph), False
+    if code:
+        # 未闭合的代码块按原样保留
+        yield tuple(title for _, title in headings), "\n".join(code), True
+
+
+def _split_block(text, is_code, target_tokens):
+    """
+    把超过目标大小的块拆成 (分隔符, 文本, token数) 单元：段落按句子、代码按行，单个句子仍超长时按token硬切
+    """
+    tokens = count_tokens(text)
+    if tokens <= target_tokens:
+        return [("\n\n", text, tokens)]
+    separator = "\n" if is_code else ""
+    parts = text.splitlines() if is_code else split_sentences(text)
+    units = []
+    for part in parts:
+        # 超长的句子/行按token id切分后再解码，不按解码文本的字符长度切原文
+        pieces = split_tokens(part, target_tokens) if count_tokens(part) > target_tokens else [part]
+        for piece in pieces:
+            if piece.strip():
+                units.append((separator, piece, count_tokens(piece)))
+    # 第一个单元与上一个块之间仍是段落分隔
+    if units:
+        units[0] = ("\n\n",) + units[0][1:]
+    return units
+
+
+def _join(units):
+    return units[0][1] + "".join(separator + text for separator, text, _ in units[1:])
+
+
+def _pack(units, target_tokens, overlap_tokens):
+    """按目标大小依次装入单元，新块开头重复上一块末尾不超过 overlap_tokens 的单元"""
+    chunks = []
+    current = []
+    current_tokens = 0
+    for unit in units:
+        if current and current_tokens + unit[2] > target_tokens:
+            chunks.append(_join(current))
+            tail = []
+            tail_tokens = 0
+            for previous in reversed(current):
+                if tail_tokens + previous[2] > overlap_tokens:
+                    break
+                tail.insert(0, previous)
+                tail_tokens += previous[2]
+            current, current_tokens = tail, tail_tokens
+        current.append(unit)
+        current_tokens += unit[2]
+    if current:
+        chunks.append(_join(current))
+    return chunks
+
+
+def chunk_markdown(text, target_tokens=None, overlap_tokens=None):
+    """
+    按markdown结构切分文本：同一标题下的段落和代码块合并到目标大小，超长内容按句子/行拆分，
+    相邻块之间保留少量重叠；不同标题下的内容不会合并到同一块
+
+    Args:
+        text: markdown文本
+        target_tokens: 每块的目标token数，默认读取 CHUNK_TARGET_TOKENS
+        overlap_tokens: 相邻块之间的重叠token数，默认读取 CHUNK_OVERLAP_TOKENS
+
+    Returns:
+        list: [{"text": 以标题路径开头的块文本, "heading": 标题路径, "tokens": 正文token数}]
+    """
+    target_tokens = target_tokens or int(os.environ.get("CHUNK_TARGET_TOKENS", "400"))
+    if overlap_tokens is None:
+        overlap_tokens = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "50"))
+
+    sections = []
+    for heading_path, block, is_code in _iter_blocks(text):
+        if not sections or sections[-1][0] != heading_path:
+            sections.append((heading_path, []))
+        sections[-1][1].extend(_split_block(block, is_code, target_tokens))
+
+    chunks = []
+    for heading_path, units in sections:
+        heading = " > ".join(heading_path)
+        for body in _pack(units, target_tokens, overlap_tokens):
+            body = body.strip()
+            if not body:
+                continue
+            # 块文本带上标题路径，嵌入和回答时都能知道这段内容属于哪个主题
+            chunks.append({
+                "text": f"# {heading}\n\n{body}" if heading else body,
+                "heading": heading,
+                "tokens": count_tokens(body),
+            })
+    return chunks
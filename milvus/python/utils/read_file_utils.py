@@ -1,20 +1,154 @@
 
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from glob import glob
 import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.logger_util import setup_logging
+from utils.markdown_chunker import chunk_markdown
 
 # 在模块加载时设置默认日志器
 logger = setup_logging('read.file.util')
 
-def read_markdown(path, recursive=True):
-    logger.info(f"Going to read markdown files from: {path}")
-    raw_text_lines = []
-    for file_path in glob(path, recursive=recursive):
-        with open(file_path, "r", encoding="utf-8") as file:
+# 扩展名 -> 文本提取函数，提取函数产出一段或多段markdown文本
+DOCUMENT_LOADERS = {}
+
+
+def register_loader(*extensions):
+    """注册文档加载器，扩展名不含点、小写"""
+    def decorator(loader):
+        for extension in extensions:
+            DOCUMENT_LOADERS[extension] = loader
+        return loader
+    return decorator
+
+
+@register_loader("md", "markdown")
+def load_markdown(file_path):
+    with open(file_path, "r", encoding="utf-8") as file:
+        yield file.read()
+
+
+@register_loader("txt")
+def load_text(file_path):
+    # 纯文本编码不确定，无法解码的字节替换掉而不是中断整个文件
+    with open(file_path, "r", encoding="utf-8", errors="replace") as file:
+        yield file.read()
+
+
+@register_loader("pdf")
+def load_pdf(file_path):
+    """逐页提取PDF文本，每页单独分块，大文件不需要一次性提取全部文本"""
+    from pypdf import PdfReader
+
+    reader = PdfReader(file_path)
+    for page_number, page in enumerate(reader.pages, start=1):
+        text = page.extract_text() or ""
+        if text.strip():
+            yield f"# Page {page_number}\n\n{text}"
+
+
+@register_loader("docx")
+def load_docx(file_path):
+    """按段落提取docx文本，Heading样式转换为markdown标题，表格按行输出"""
+    import docx
+
+    document = docx.Document(file_path)
+    lines = []
+    for paragraph in document.paragraphs:
+        style = paragraph.style.name if paragraph.style is not None else ""
+        if style.startswith("Heading") and style[len("Heading"):].strip().isdigit():
+            level = min(int(style[len("Heading"):]), 6)
+            lines.append(f"{'#' * level} {paragraph.text}")
+        elif paragraph.text.strip():
+            lines.append(paragraph.text)
+        lines.append("")
+    for table in document.tables:
+        for row in table.rows:
+            lines.append(" | ".join(cell.text.strip() for cell in row.cells))
+        lines.append("")
+    yield "\n".join(lines)
+
+
+def load_document_chunks(file_path):
+    """
+    按扩展名选择加载器提取文本并分块，可在子进程中执行
+
+    Returns:
+        list: chunk_markdown 返回的块列表
+
+    Raises:
+        ValueError: 不支持的文件格式
+        Exception: 解析失败或缺少可选依赖时原样抛出，不能当作空文档处理（sync 模式会据此删除已有内容）
+    """
+    extension = os.path.splitext(file_path)[1].lstrip(".").lower()
+    loader = DOCUMENT_LOADERS.get(extension)
+    if loader is None:
+        raise ValueError(f"No loader for .{extension} files")
+    chunks = []
+    for text in loader(file_path):
+        chunks.extend(chunk_markdown(text))
+    return chunks
+
+
+def _load_or_report(file_path, future=None, failures=None):
+    """取回一个文件的解析结果，失败时记录到 failures 并返回 None"""
+    try:
+        return future.result() if future is not None else load_document_chunks(file_path)
+    except Exception as e:
+        logger.error(f"Skipping {file_path}: failed to load: {str(e)}")
+        if failures is not None:
+            failures.append({"path": file_path, "error": str(e)})
+        return None
+
+
+def iter_document_files(path, recursive=True, max_workers=None, failures=None):
+    """
+    读取 md/txt/pdf/docx 文档并分块，glob匹配多个文件时在进程池中并行解析
+
+    Args:
+        path: 文件路径或glob模式
+        recursive: 是否递归匹配 ** 模式
+        max_workers: 解析进程数，默认读取 DOC_LOADER_WORKERS（默认CPU核数），1表示在当前进程解析
+        failures: 可选列表，解析失败的文件以 {"path", "error"} 追加到其中
+
+    Yields:
+        tuple: (文件路径, 该文件的块列表)，按文件路径排序，与并行度无关；解析失败的文件不会产出
+    """
+    logger.info(f"Going to read documents from: {path}")
+    # 排序保证多次运行的块顺序一致，便于断点续传
+    file_paths = sorted(file_path for file_path in glob(path, recursive=recursive) if os.path.isfile(file_path))
+    max_workers = max_workers or int(os.environ.get("DOC_LOADER_WORKERS", str(os.cpu_count() or 1)))
+    max_workers = min(max_workers, len(file_paths))
+    if max_workers <= 1:
+        for file_path in file_paths:
+            logger.info(f"processing file at {file_path}")
+            chunks = _load_or_report(file_path, failures=failures)
+            if chunks is not None:
+                yield file_path, chunks
+        return
+
+    # 最多提前解析 2*max_workers 个文件，下游嵌入较慢时不会把所有解析结果堆在内存里
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        remaining = iter(file_paths)
+        for file_path in remaining:
+            pending.append((file_path, executor.submit(load_document_chunks, file_path)))
+            if len(pending) >= 2 * max_workers:
+                break
+        while pending:
+            file_path, future = pending.popleft()
             logger.info(f"processing file at {file_path}")
-            file_text = file.read()
-        raw_text_lines += file_text.split("# ")
-    return raw_text_lines
\ No newline at end of file
+            chunks = _load_or_report(file_path, future, failures)
+            if chunks is not None:
+                yield file_path, chunks
+            next_path = next(remaining, None)
+            if next_path is not None:
+                pending.append((next_path, executor.submit(load_document_chunks, next_path)))
+
+
+def read_markdown(path, recursive=True):
+    """读取文档并返回所有块的文本，是 iter_document_files 的简单包装"""
+    return [chunk["text"] for _, chunks in iter_document_files(path, recursive=recursive) for chunk in chunks]
@@ -0,0 +1,75 @@
+import codecs
+import os
+import re
+import sys
+from functools import lru_cache
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.logger_util import setup_logging
+
+# 在模块加载时设置默认日志器
+logger = setup_logging('token.util')
+
+_CJK_PATTERN = re.compile(r"[一-鿿]")
+# 句末标点或换行处切分句子，保留标点；英文句号后需跟空白，避免切开版本号和小数
+_SENTENCE_PATTERN = re.compile(r".+?(?:[。！？!?]+|\.(?=\s)|\n|$)", re.S)
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    """tiktoken 为可选依赖，未安装时按字符数估算token数"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(os.environ.get("TOKENIZER_ENCODING", "cl100k_base"))
+    except Exception as e:
+        logger.warning(f"tiktoken unavailable, estimating token counts from characters: {str(e)}")
+        return None
+
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # 中文约每字一个token，其他字符约每4个一个token
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_tokens(text, max_tokens):
+    """截断到不超过 max_tokens 个token"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text)[:max_tokens])
+    # 估算模式下按比例截断后逐步收缩
+    end = len(text) * max_tokens // max(count_tokens(text), 1)
+    while end > 0 and count_tokens(text[:end]) > max_tokens:
+        end -= max(1, end // 20)
+    return text[:end]
+
+
+def split_tokens(text, max_tokens):
+    """
+    把文本切成每段不超过 max_tokens 个token的若干段，各段按顺序拼接后与原文完全一致
+
+    按token id切分后再解码；跨段的多字节字符整体留到下一段，不会被解码成替换字符
+    """
+    encoding = _get_encoding()
+    if encoding is None:
+        # 估算模式下 truncate_tokens 返回的是原文前缀，可以直接按长度切
+        pieces = []
+        while text:
+            head = truncate_tokens(text, max_tokens) or text[:1]
+            pieces.append(head)
+            text = text[len(head):]
+        return pieces
+    ids = encoding.encode(text)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pieces = [decoder.decode(encoding.decode_bytes(ids[i:i + max_tokens])) for i in range(0, len(ids), max_tokens)]
+    if pieces:
+        pieces[-1] += decoder.decode(b"", final=True)
+    return [piece for piece in pieces if piece]
+
+
+def split_sentences(text):
+    """把文本切分为句子，丢弃空白句子"""
+    return [sentence for sentence in _SENTENCE_PATTERN.findall(text) if sentence.strip()]